@@ -0,0 +1,419 @@
+# This script benchmarks the hot paths of the game and of training, so performance work can be tracked over time.
+# "run" times every benchmark with fixed seeds and saves the results as a JSON baseline,
+#   and "compare" reports the change of each benchmark between two baselines and flags the regressions.
+# Regressions are judged on the fastest of the repeats, with the threshold widened by how noisy each benchmark was.
+# benchmarks/baseline.json holds the results of the committed tree on the machine it was taken on, with one CPU thread.
+#   Timings are only comparable on the same machine, so regenerate the baseline on each machine before comparing:
+#   check out the commit to compare against and run "python Benchmark.py run --output benchmarks/baseline.json".
+# Usage:
+#   python Benchmark.py run --output benchmarks/latest.json --compare benchmarks/baseline.json
+#   python Benchmark.py run --output benchmarks/before.json
+#   python Benchmark.py compare benchmarks/before.json benchmarks/latest.json --threshold 0.1
+
+# Standard library imports
+import argparse, datetime, io, json, os, platform, random, statistics, sys, tempfile, time
+from contextlib import contextmanager, redirect_stdout
+
+# Third-party imports
+import torch
+
+# Local imports
+from card_game_utils.Deck import Deck, CARDS
+from card_game_utils.TrickTaking import Trick
+from DoubleDummy import DoubleDummySolver
+from GeneralDQN import DQN
+from InferencePolicy import InferencePolicy, export_policy
+from TennisEnv import TennisEnv, STATE_SIZE
+from TennisQNet import TennisLeaderQNetwork, TennisDealerQNetwork
+
+HYPERPARAMETERS = {"LR": 1e-4, "EPS_DECAY": 1e5, "CHECKPOINT_FREQUENCY": 0}
+INFERENCE_BATCH = 400 # the states in a batch of moves, as many as DQN.validate plays at once
+
+def _seed(seed):
+    random.seed(seed)
+    torch.manual_seed(seed)
+
+def _random_action(environment):
+    # A uniformly random legal action
+    bits = environment.legal_action_bits()
+    return random.choice([index for index in range(52) if bits >> index & 1])
+
+def _random_position(plies):
+    # A game with nobody to ask for moves, after the given number of random moves
+    environment = TennisEnv(None, None, rewarded_player="leader")
+    environment.reset()
+    for _ in range(plies):
+        environment.step_helper(_random_action(environment))
+    return environment
+
+@contextmanager
+def _scratch_directory():
+    # DQN writes its TensorBoard logs to the working directory, so run it somewhere that is thrown away
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+def _make_players():
+    # A leader and a dealer with freshly initialized networks
+    with redirect_stdout(io.StringIO()):
+        return DQN(TennisLeaderQNetwork, HYPERPARAMETERS), DQN(TennisDealerQNetwork, HYPERPARAMETERS)
+
+# Every benchmark is set up by a function of the options, which returns the function to time
+#   and the number of operations one call of it makes. Setup is not timed. Benchmarks whose
+#   operation changes its inputs (such as playing a card) time a fresh copy of them as part of each call.
+
+def bench_deck_play(options):
+    deck = Deck()
+    deck.reset()
+    order = list(deck.cards)
+    random.shuffle(order)
+    def run():
+        copy = deck.copy()
+        for card in order:
+            copy.play(card)
+    return run, 52
+
+def bench_deck_draw(options):
+    deck = Deck()
+    deck.reset()
+    deck.shuffle()
+    def run():
+        copy = deck.copy()
+        for _ in range(4):
+            copy.draw(13)
+    return run, 4
+
+def bench_deck_copy(options):
+    deck = Deck()
+    deck.reset()
+    return deck.copy, 1
+
+def bench_trick_add_card(options):
+    cards = random.sample(CARDS, 4)
+    def run():
+        trick = Trick('S')
+        for card in cards:
+            trick.add_card(card)
+    return run, 4
+
+def bench_trick_get_legal_moves(options):
+    # One trick for each lead suit, against the same 13-card hand
+    deck = Deck()
+    deck.reset()
+    deck.shuffle()
+    hand = deck.draw(13)
+    tricks = []
+    for card in deck.draw(4):
+        trick = Trick('S')
+        trick.add_card(card)
+        tricks.append(trick)
+    def run():
+        for trick in tricks:
+            trick.get_legal_moves(hand)
+    return run, len(tricks)
+
+def bench_env_get_suit_mapping(options):
+    # The mapping is cached, so clear it to time computing it
+    environment = _random_position(20)
+    def run():
+        environment._suit_mapping = None
+        environment.get_suit_mapping()
+    return run, 1
+
+def bench_env_get_legal_moves(options):
+    environment = _random_position(21) # within a trick, so suit must be followed
+    return environment.get_legal_moves, 1
+
+def bench_env_get_current_state(options):
+    environment = _random_position(20)
+    return environment.get_current_state, 1
+
+def bench_env_reset(options):
+    environment = TennisEnv(None, None, rewarded_player="leader")
+    return environment.reset, 1
+
+def bench_random_game(options):
+    # A whole game of uniformly random legal moves, from the deal to the score
+    environment = TennisEnv(None, None, rewarded_player="leader")
+    def run():
+        environment.reset()
+        while not environment.done:
+            environment.step_helper(_random_action(environment))
+    return run, 1
+
+def bench_solve_endgame(options):
+    # An exact solve of the last five tricks, with a new solver each time so nothing is remembered between calls
+    environment = _random_position(4 + 4 * 7)
+    return lambda: DoubleDummySolver().solve(environment), 1
+
+def bench_choose_action(options):
+    leader, dealer = _make_players()
+    environment = _random_position(20)
+    return lambda: leader.choose_action(environment), 1
+
+def bench_frozen_choose_action(options):
+    # The same move as dqn.choose_action, picked by the exported policy of the same network
+    leader, dealer = _make_players()
+    export_policy(leader.policy_net, "leader.ts")
+    policy = InferencePolicy("leader.ts", threads=None)
+    environment = _random_position(20)
+    return lambda: policy.choose_action(environment), 1
+
+def bench_int8_choose_action(options):
+    # The same move again, picked by the exported policy with dynamically quantized int8 weights, which is no faster:
+    #   a single move is dominated by the per-call overhead, not the matrix multiplies
+    leader, dealer = _make_players()
+    export_policy(leader.policy_net, "leader_int8.ts", quantize=True)
+    policy = InferencePolicy("leader_int8.ts", threads=None)
+    environment = _random_position(20)
+    return lambda: policy.choose_action(environment), 1
+
+def bench_int8_choose_actions(options):
+    # A batch of moves, as in validation, tournaments and the InferenceServer, the only case int8 weights speed up
+    leader, dealer = _make_players()
+    export_policy(leader.policy_net, "leader_int8.ts", quantize=True)
+    policy = InferencePolicy("leader_int8.ts", threads=None)
+    states, legal_mask = torch.rand(INFERENCE_BATCH, STATE_SIZE), torch.ones(INFERENCE_BATCH, 52, dtype=torch.bool)
+    return lambda: policy.choose_actions(states, legal_mask), INFERENCE_BATCH
+
+def bench_frozen_choose_actions(options):
+    # The same batch with fp32 weights
+    leader, dealer = _make_players()
+    export_policy(leader.policy_net, "leader.ts")
+    policy = InferencePolicy("leader.ts", threads=None)
+    states, legal_mask = torch.rand(INFERENCE_BATCH, STATE_SIZE), torch.ones(INFERENCE_BATCH, 52, dtype=torch.bool)
+    return lambda: policy.choose_actions(states, legal_mask), INFERENCE_BATCH
+
+def bench_optimize_model(options):
+    # One optimization step from a replay memory of random games
+    leader, dealer = _make_players()
+    environment = TennisEnv(leader, dealer, rewarded_player="leader")
+    while len(leader.memory) < leader.BATCH_SIZE * 5:
+        state = environment.reset()
+        done = False
+        while not done:
+            action = _random_action(environment)
+            next_state, reward, done, exit_cond = environment.step(action)
+            leader.memory.push(state.unsqueeze(0), torch.tensor([[action]]), None if done else next_state.unsqueeze(0), reward)
+            state = next_state
+    return leader.optimize_model, 1
+
+def bench_training_run(options):
+    # Training a fresh leader against a fresh dealer for a fixed number of games, including exploration,
+    #   replay and optimization but not validation
+    leader, dealer = _make_players()
+    environment = TennisEnv(leader, dealer, rewarded_player="leader")
+    def run():
+        with redirect_stdout(io.StringIO()):
+            leader.train(environment, save_name="benchmark", games=options["train_games"])
+    return run, options["train_games"]
+
+# name: (setup, whether the run function changes state between calls, so each repeat needs a new setup)
+BENCHMARKS = {
+    "deck.play": (bench_deck_play, False),
+    "deck.draw": (bench_deck_draw, False),
+    "deck.copy": (bench_deck_copy, False),
+    "trick.add_card": (bench_trick_add_card, False),
+    "trick.get_legal_moves": (bench_trick_get_legal_moves, False),
+    "env.get_suit_mapping": (bench_env_get_suit_mapping, False),
+    "env.get_legal_moves": (bench_env_get_legal_moves, False),
+    "env.get_current_state": (bench_env_get_current_state, False),
+    "env.reset": (bench_env_reset, False),
+    "game.random_policy": (bench_random_game, False),
+    "dd.solve_endgame": (bench_solve_endgame, False),
+    "dqn.choose_action": (bench_choose_action, False),
+    "frozen.choose_action": (bench_frozen_choose_action, False),
+    "int8.choose_action": (bench_int8_choose_action, False),
+    "frozen.choose_actions": (bench_frozen_choose_actions, False),
+    "int8.choose_actions": (bench_int8_choose_actions, False),
+    "dqn.optimize_model": (bench_optimize_model, False),
+    "dqn.training_run": (bench_training_run, True),
+}
+
+def time_benchmark(name, options):
+    """
+    Time one benchmark.
+
+    The function is called enough times for each repeat to take at least options["min_time"] seconds
+    (once per repeat for stateful benchmarks, which are set up again with the same seed for every repeat).
+
+    Args:
+        name (str): The name of the benchmark in BENCHMARKS.
+        options (dict): "seed", "repeats", "min_time" and "train_games".
+
+    Returns:
+        dict: The median and minimum seconds per operation, the seconds per operation of each repeat,
+              the calls per repeat and the operations per call.
+    """
+    setup, stateful = BENCHMARKS[name]
+    _seed(options["seed"])
+    run, operations = setup(options)
+
+    # Find the number of calls for one repeat to last min_time, as timeit does
+    number = 1
+    if not stateful:
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                run()
+            if time.perf_counter() - start >= options["min_time"]:
+                break
+            number *= 2
+
+    repeats = []
+    for repeat in range(options["repeats"]):
+        if stateful and repeat > 0:
+            _seed(options["seed"])
+            run, operations = setup(options)
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        repeats.append((time.perf_counter() - start) / (number * operations))
+    return {"median": statistics.median(repeats), "min": min(repeats), "repeats": repeats,
+            "number": number, "operations": operations}
+
+def run_benchmarks(names=None, seed=0, repeats=10, min_time=0.2, train_games=50, threads=1):
+    """
+    Run benchmarks with fixed seeds.
+
+    Args:
+        names (list, optional): The benchmarks to run, all of them if None.
+        seed (int): The seed every benchmark is set up with.
+        repeats (int): The number of timed repeats of each benchmark.
+        min_time (float): The least seconds each repeat of a microbenchmark lasts.
+        train_games (int): The games of the training run benchmark.
+        threads (int): The number of torch threads.
+
+    Returns:
+        dict: "metadata" about the machine and the run, and the timing of each benchmark under "benchmarks".
+    """
+    names = names or list(BENCHMARKS)
+    for name in names:
+        assert name in BENCHMARKS, f"Unknown benchmark {name}, choose from {', '.join(BENCHMARKS)}"
+    torch.set_num_threads(threads)
+    options = {"seed": seed, "repeats": repeats, "min_time": min_time, "train_games": train_games}
+
+    results = {}
+    with _scratch_directory():
+        for name in names:
+            results[name] = time_benchmark(name, options)
+            print(f"{name.ljust(24)} {format_seconds(results[name]['min'])}/op")
+    metadata = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                "torch": torch.__version__, "platform": platform.platform(), "processor": platform.processor(),
+                "cpus": os.cpu_count(), "threads": threads, "seed": seed, "repeats": repeats, "min_time": min_time,
+                "train_games": train_games}
+    return {"metadata": metadata, "benchmarks": results}
+
+def format_seconds(seconds):
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+def spread(result):
+    """Return the relative gap between the median and the minimum time of a benchmark's repeats, a measure of its noise."""
+    return result["median"] / result["min"] - 1
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Compare the minimum time per operation of each benchmark in two results.
+
+    The minimum over the repeats is the timing least disturbed by the rest of the machine. A benchmark only counts as
+    slower or faster beyond the threshold plus the spread of both results, so noisy benchmarks need a larger change.
+
+    Args:
+        baseline (dict): The results to compare against, as returned by run_benchmarks.
+        current (dict): The new results.
+        threshold (float): The relative slowdown beyond which a benchmark without noise is a regression (0.1 is 10% slower).
+
+    Returns:
+        tuple: The lines of the comparison table and the names of the benchmarks that regressed.
+    """
+    lines = [f"{'benchmark'.ljust(24)} {'baseline'.rjust(12)} {'current'.rjust(12)} {'change'.rjust(8)} {'allowed'.rjust(8)}"]
+    regressions = []
+    for name, result in current["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            lines.append(f"{name.ljust(24)} {'-'.rjust(12)} {format_seconds(result['min']).rjust(12)}")
+            continue
+        before, after = baseline["benchmarks"][name]["min"], result["min"]
+        change = after / before - 1
+        allowed = threshold + spread(baseline["benchmarks"][name]) + spread(result)
+        flag = ""
+        if change > allowed:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -allowed:
+            flag = "  faster"
+        lines.append(f"{name.ljust(24)} {format_seconds(before).rjust(12)} {format_seconds(after).rjust(12)} {change:+8.1%} "
+                     f"{allowed:8.1%}{flag}")
+
+    # Timings from different setups are not comparable, so point out what changed
+    for key in ["python", "torch", "platform", "cpus", "threads", "train_games"]:
+        if baseline["metadata"].get(key) != current["metadata"].get(key):
+            lines.append(f"Note: {key} differs ({baseline['metadata'].get(key)} -> {current['metadata'].get(key)})")
+    return lines, regressions
+
+def read_results(path):
+    with open(path) as file:
+        return json.load(file)
+
+def write_results(results, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+def report_comparison(baseline, current, threshold):
+    # Print the comparison and return the exit status, 1 if anything regressed
+    lines, regressions = compare_results(baseline, current, threshold)
+    print("\n".join(lines))
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {threshold:.0%} plus the noise: {', '.join(regressions)}")
+        return 1
+    print(f"No regressions beyond {threshold:.0%} plus the noise")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and save the results")
+    run_parser.add_argument("--output", default="benchmarks/latest.json", help="The JSON file to save the results to")
+    run_parser.add_argument("--only", nargs="+", default=None, help=f"The benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    run_parser.add_argument("--seed", type=int, default=0, help="The seed every benchmark is set up with")
+    run_parser.add_argument("--repeats", type=int, default=10, help="The number of timed repeats of each benchmark")
+    run_parser.add_argument("--min_time", type=float, default=0.2, help="The least seconds each repeat of a microbenchmark lasts")
+    run_parser.add_argument("--train_games", type=int, default=50, help="The games of the training run benchmark")
+    run_parser.add_argument("--threads", type=int, default=1, help="The number of torch threads")
+    run_parser.add_argument("--compare", default=None, help="A baseline (.json) to compare the results to (optional)")
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="The relative slowdown beyond the noise that counts as a regression")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved results")
+    compare_parser.add_argument("baseline", help="The results (.json) to compare against")
+    compare_parser.add_argument("current", help="The new results (.json)")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="The relative slowdown beyond the noise that counts as a regression")
+    args = parser.parse_args()
+
+    # A missing baseline is an error before anything runs, not a comparison that silently never happens
+    if args.command == "run":
+        compared = [args.compare] if args.compare else []
+    else:
+        compared = [args.baseline, args.current]
+    for path in compared:
+        if not os.path.isfile(path):
+            parser.error(f"No results to compare at {path}; save some with 'python Benchmark.py run --output {path}'")
+
+    if args.command == "run":
+        results = run_benchmarks(args.only, seed=args.seed, repeats=args.repeats, min_time=args.min_time,
+                                 train_games=args.train_games, threads=args.threads)
+        write_results(results, args.output)
+        print(f"Wrote results to {args.output}")
+        if args.compare:
+            sys.exit(report_comparison(read_results(args.compare), results, args.threshold))
+    else:
+        sys.exit(report_comparison(read_results(args.baseline), read_results(args.current), args.threshold))
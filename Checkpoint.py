@@ -0,0 +1,132 @@
+# This script writes training checkpoints in the background, so saving them does not pause training.
+# A checkpoint is one torch.save file. Its tensors are stored uncompressed and aligned,
+#   so read_checkpoint can memory-map it and the replay memory is only read from disk as it is copied.
+
+# Standard library imports
+import os, queue, signal, threading
+from contextlib import contextmanager
+
+# Third-party imports
+import torch
+
+def clone_tensors(value):
+    """Return a copy of a nested structure of dicts, lists, tuples and tensors, with every tensor cloned to the CPU."""
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: clone_tensors(item) for key, item in value.items()}
+    if isinstance(value, tuple) and hasattr(value, "_fields"): # namedtuple
+        return type(value)(*(clone_tensors(item) for item in value))
+    if isinstance(value, (list, tuple)):
+        return type(value)(clone_tensors(item) for item in value)
+    return value
+
+def write_checkpoint(checkpoint, path):
+    """Save a checkpoint atomically, so an interrupted write never replaces the last good checkpoint."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = path + ".tmp"
+    try:
+        torch.save(checkpoint, temporary_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    os.replace(temporary_path, path)
+
+def read_checkpoint(path, map_location="cpu"):
+    """Load a checkpoint with its tensors memory-mapped from the file."""
+    return torch.load(path, map_location=map_location, mmap=True, weights_only=False)
+
+class CheckpointWriter:
+    """
+    CheckpointWriter saves checkpoints from a background thread.
+
+    The training thread takes a snapshot (see clone_tensors) and hands it over, then keeps training while it is written.
+    Only the newest snapshot waits to be written: if another one arrives before the writer is free, the older one is dropped.
+    A checkpoint that fails to be written is raised again from the next submit or flush, so training does not go on without them.
+
+    Attributes:
+        written (int): The number of checkpoints written so far.
+        error (RuntimeError): The error of the last failed write, until it is raised, or None.
+    """
+    def __init__(self):
+        self.pending = queue.Queue(maxsize=1)
+        self.written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def submit(self, checkpoint, path):
+        """
+        Queue a snapshot to be saved to the path.
+
+        Raises:
+            RuntimeError: If an earlier checkpoint could not be written.
+        """
+        self._raise_error()
+        while True:
+            try:
+                self.pending.put_nowait((checkpoint, path))
+                return
+            except queue.Full:
+                try:
+                    self.pending.get_nowait() # replace the older snapshot
+                    self.pending.task_done()
+                except queue.Empty:
+                    pass
+
+    def flush(self):
+        """
+        Wait until every queued snapshot is written.
+
+        Raises:
+            RuntimeError: If a checkpoint could not be written.
+        """
+        self.pending.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        # Raise the error of a failed write once, in the training thread
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _write(self):
+        while True:
+            checkpoint, path = self.pending.get()
+            try:
+                write_checkpoint(checkpoint, path)
+                self.written += 1
+            except Exception as e:
+                self.error = RuntimeError(f"Error saving checkpoint to {path}: {e}")
+                self.error.__cause__ = e
+            finally:
+                self.pending.task_done()
+
+# The signals that ask for a checkpoint, and whether training should stop after it
+CHECKPOINT_SIGNALS = {signal.SIGINT: True, signal.SIGTERM: True}
+if hasattr(signal, "SIGUSR1"):
+    CHECKPOINT_SIGNALS[signal.SIGUSR1] = False
+
+@contextmanager
+def checkpoint_on_signals(callback):
+    """
+    Call callback(stop) when a checkpoint signal arrives, instead of the signal's usual handler.
+
+    SIGINT and SIGTERM ask for a checkpoint and then a stop; SIGUSR1 (where it exists) only asks for a checkpoint.
+    Handlers can only be installed from the main thread, so elsewhere this does nothing.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    previous_handlers = {}
+    for signum, stop in CHECKPOINT_SIGNALS.items():
+        previous_handlers[signum] = signal.signal(signum, lambda signum, frame, stop=stop: callback(stop))
+    try:
+        yield
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
@@ -0,0 +1,91 @@
+# This script creates and reads deal banks: files of pre-shuffled Tennis deals.
+# A deal bank is a .npy file of records holding the 52 card indices of a deal as uint8 and a trump flag.
+# It is memory-mapped when opened, so any deal can be read in O(1) without loading the whole file,
+#   and training, validation and evaluation can all play the same deals no matter how random was seeded.
+
+# Standard library imports
+import argparse
+
+# Third-party imports
+import numpy
+import torch
+
+# One deal: the card indices in the order they are dealt (see VecTennisEnv.DEAL_SLICES) and whether spades are trump
+DEAL_DTYPE = numpy.dtype([("cards", numpy.uint8, (52,)), ("trump", numpy.bool_)])
+
+def create_deal_bank(path, num_deals, seed=0, chunk_size=1 << 20):
+    """
+    Write a deal bank of uniformly random deals.
+
+    Args:
+        path (str): The .npy file to write.
+        num_deals (int): The number of deals.
+        seed (int): The seed of the deals.
+        chunk_size (int): The number of deals shuffled at a time.
+    """
+    rng = numpy.random.default_rng(seed)
+    bank = numpy.lib.format.open_memmap(path, mode="w+", dtype=DEAL_DTYPE, shape=(num_deals,))
+    for start in range(0, num_deals, chunk_size):
+        count = min(chunk_size, num_deals - start)
+        bank["cards"][start:start + count] = rng.permuted(numpy.tile(numpy.arange(52, dtype=numpy.uint8), (count, 1)), axis=1)
+        bank["trump"][start:start + count] = rng.random(count) < 0.5
+    bank.flush()
+
+class DealBank:
+    """
+    DealBank reads the deals of a deal bank file.
+
+    Indices do not wrap around: the first deals of a bank are often held out for validation, so running out of
+    deals is left to the caller (see TennisEnv.reset) rather than silently replaying them.
+
+    Attributes:
+        path (str): The deal bank file.
+        deals (numpy.memmap): The memory-mapped records of every deal.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.deals = numpy.load(path, mmap_mode="r")
+        assert self.deals.dtype == DEAL_DTYPE, f"{path} is not a deal bank"
+
+    def __len__(self):
+        return len(self.deals)
+
+    def __getitem__(self, index):
+        """Return the card indices (a list of 52 ints) and the trump flag of a deal."""
+        if not 0 <= index < len(self.deals):
+            raise IndexError(f"Deal {index} is not in {self.path}, which has {len(self.deals)} deals")
+        deal = self.deals[index]
+        return deal["cards"].tolist(), bool(deal["trump"])
+
+    # Pickle only the path, so a bank can be handed to other processes, which map the file themselves
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def batch(self, start, count):
+        """
+        Read a range of deals as tensors, for VecTennisEnv.reset.
+
+        Args:
+            start (int): The index of the first deal.
+            count (int): The number of deals.
+
+        Returns:
+            tuple: The [count, 52] long card indices and the [count] bool trump flags.
+        """
+        if start < 0 or start + count > len(self.deals):
+            raise IndexError(f"Deals {start} to {start + count - 1} are not all in {self.path}, which has {len(self.deals)} deals")
+        deals = self.deals[start:start + count]
+        return torch.from_numpy(deals["cards"].astype(numpy.int64)), torch.from_numpy(deals["trump"].copy())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="deals.npy", help="The deal bank file to write")
+    parser.add_argument("--deals", type=int, default=1000000, help="The number of deals")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the deals")
+    args = parser.parse_args()
+
+    create_deal_bank(args.output, args.deals, args.seed)
+    print(f"Wrote {args.deals} deals to {args.output}")
@@ -0,0 +1,494 @@
+# This script solves the trick-play phase of Tennis exactly, with every hand face up (double dummy).
+# After the four bids, each hand holds 12 cards and every trick is played in the same order:
+#   leader forehand, dealer forehand, leader backhand, dealer backhand.
+# The leader plays to maximize the dealer's bid error minus its own, the dealer to minimize it, which decides who wins.
+# The search is MTD(f) over alpha-beta on single cards, trying only one card of each run of cards that no other hand can split,
+#   and trying first the cards that take or give up the trick as suits the side to play.
+# Its transposition table holds trick-start positions keyed on the order of the live cards of each suit and the tricks
+#   each hand still needs, so positions that differ only in lower cards gone or in tricks past a bid share an entry.
+# With five tricks left a position solves in about 10 ms, with eight in about 300 ms, and a whole deal can take a minute
+#   in pure Python, so choose_action only searches once few enough tricks are left (solve_tricks, 5 by default)
+#   and leaves earlier moves to a fallback player.
+# Usage:
+#   python DoubleDummy.py --tricks 6 --deals 20 [--deepen]
+
+# Standard library imports
+import argparse, random, time
+from collections import namedtuple
+
+# Third-party imports
+import torch
+
+# Local imports
+from card_game_utils.Deck import SUITS
+from TennisEnv import TennisEnv
+
+# The hands in the order they play every trick, which is also the order of the hands of a Position
+HANDS = ("leader_forehand", "dealer_forehand", "leader_backhand", "dealer_backhand")
+SUIT_MASK = (1 << 13) - 1 # the 13 bits of one suit, from 2 to A
+
+# A play-phase position, with the hands in the order of HANDS
+# hands: the card bits of each hand; trick: the card indices played to the current trick; wins: the tricks won by
+#   each hand; bids: the value bid for each hand; trump: the suit index of trumps, or None
+Position = namedtuple('Position', ('hands', 'trick', 'wins', 'bids', 'trump'))
+
+def position_from_env(env):
+    """Read the position of a TennisEnv whose four bids have been made."""
+    leader, dealer = env.leader, env.dealer
+    assert dealer.forehand_bid["card"] is not None, "The position must be in the trick-play phase"
+    return Position(
+        hands=[leader.forehand.bits, dealer.forehand.bits, leader.backhand.bits, dealer.backhand.bits],
+        trick=[card.action_index for card in env.current_trick.cards],
+        wins=[leader.forehand_wins, dealer.forehand_wins, leader.backhand_wins, dealer.backhand_wins],
+        bids=[leader.forehand_bid["value"], dealer.forehand_bid["value"], leader.backhand_bid["value"], dealer.backhand_bid["value"]],
+        trump=SUITS.index(env.trump_suit) if env.trump_suit else None,
+    )
+
+def bid_errors(wins, bids):
+    """Return the leader's and the dealer's bid errors for the tricks won by each hand."""
+    leader_error = abs(bids[0] - wins[0]) + abs(bids[2] - wins[2])
+    dealer_error = abs(bids[1] - wins[1]) + abs(bids[3] - wins[3])
+    return leader_error, dealer_error
+
+def trick_winner(trick, trump):
+    """Return the index in the trick of the card that wins it so far, by the rules of Trick.would_win."""
+    winner = 0
+    for index in range(1, len(trick)):
+        card, winning_card = trick[index], trick[winner]
+        if card // 13 == winning_card // 13:
+            if card > winning_card:
+                winner = index
+        elif card // 13 == trump:
+            winner = index
+    return winner
+
+# The splits of each number of tricks between the four hands
+_SPLITS = [[(a, b, c, n - a - b - c) for a in range(n + 1) for b in range(n + 1 - a) for c in range(n + 1 - a - b)]
+           for n in range(14)]
+
+EXACT = 13 # a search depth past the last trick
+
+# The owners of the live cards of one suit, by the holdings of each hand in the suit
+_SUIT_KEYS = {}
+
+def _suit_key(hands, shift):
+    # Only the order of the live cards matters, not their ranks, so positions that differ only in which
+    #   lower cards are gone share a key: the hand holding each live card, highest first, in base 4 after a leading 1
+    holdings = (hands[0] >> shift & SUIT_MASK, hands[1] >> shift & SUIT_MASK, hands[2] >> shift & SUIT_MASK, hands[3] >> shift & SUIT_MASK)
+    key = _SUIT_KEYS.get(holdings)
+    if key is None:
+        key = 1
+        for rank in range(12, -1, -1):
+            for hand, holding in enumerate(holdings):
+                if holding >> rank & 1:
+                    key = key * 4 + hand
+        _SUIT_KEYS[holdings] = key
+    return key
+
+# The runs of own cards, by suit and the (own, others) bits of the suit
+_RUNS = {}
+
+def _runs(suit, own, others):
+    # Cards of one hand with no other live card between them win and lose the same tricks, so one of each run is enough
+    # Returns the lowest card of each run, and the lowest card of the run of each own card
+    lowest, run_of = [], {}
+    bits = own | others
+    in_run = False
+    while bits:
+        low_bit = bits & -bits
+        bits ^= low_bit
+        card = 13 * suit + low_bit.bit_length() - 1
+        if own & low_bit:
+            if not in_run:
+                lowest.append(card)
+            run_of[card] = lowest[-1]
+            in_run = True
+        else:
+            in_run = False
+    return lowest, run_of
+
+class DoubleDummySolver:
+    """
+    DoubleDummySolver finds the result of perfect play from any trick-play position.
+
+    Scores are the dealer's bid error minus the leader's, the game's reward for the leader times 24,
+    so the leader maximizes them and the dealer minimizes them.
+    The solver also has the choose_action method of DQN, so it can be the leader or dealer of a TennisEnv.
+    It has no opinion on bids, which are left to the fallback player, as are positions too early to solve quickly.
+
+    Attributes:
+        table (dict): The transposition table, from trick-start positions to (lower bound, upper bound, best card, depth searched),
+                      with the bounds relative to the score the position's tricks past the bids already decide.
+        max_table_size (int): The number of positions after which the table is cleared.
+        nodes (int): The number of positions searched so far.
+        fallback: A player with a choose_action method to make the bids and the moves with more than solve_tricks tricks left,
+                  or None for random moves.
+        solve_tricks (int): The most tricks left for choose_action to solve. Searches grow quickly with the tricks left:
+                            with five a move takes under a millisecond on average and at most a few tens,
+                            with seven the first solved move of a game can take most of a second.
+        deepen (bool): Whether to run MTD(f) one trick deeper at a time before the exact search, scoring the positions
+                       past the depth reached by the middle of their possible scores. It searches more positions than
+                       a single exact MTD(f) at every depth measured, so it is off by default.
+    """
+    def __init__(self, max_table_size=2000000, fallback=None, solve_tricks=5, deepen=False):
+        self.table = {}
+        self.max_table_size = max_table_size
+        self.nodes = 0
+        self.fallback = fallback
+        self.solve_tricks = solve_tricks
+        self.deepen = deepen
+        self._bounds = {} # the lowest and highest scores still possible, by the tricks each hand needs and can take
+        self.trump = None # the trump suit the table was computed for
+
+    def _prepare(self, position):
+        # The table is keyed on the tricks each hand needs, so it holds for any bids, but not for other trumps
+        if position.trump != self.trump or len(self.table) > self.max_table_size:
+            self.table.clear()
+            self._bounds.clear()
+        self.bids = position.bids
+        self.trump = position.trump
+
+    def _score_bounds(self, needs, remaining, limits=None):
+        # The lowest and highest scores of any split of the remaining tricks, for the tricks each hand still needs,
+        #   among the splits that give each hand between the fewest and most tricks it can take (limits), if known
+        key = (needs[0], needs[1], needs[2], needs[3], remaining, limits)
+        bounds = self._bounds.get(key)
+        if bounds is None:
+            low0, low1, low2, low3, high0, high1, high2, high3 = limits or (0, 0, 0, 0, remaining, remaining, remaining, remaining)
+            scores = [abs(needs[1] - b) + abs(needs[3] - d) - abs(needs[0] - a) - abs(needs[2] - c) for a, b, c, d in _SPLITS[remaining]
+                      if low0 <= a <= high0 and low1 <= b <= high1 and low2 <= c <= high2 and low3 <= d <= high3]
+            bounds = self._bounds[key] = (min(scores), max(scores))
+        return bounds
+
+    def _trick_limits(self, hands, remaining):
+        # The fewest and most tricks each hand can take from a trick start
+        # A trump above every other hand's trumps always wins, and so does any card of the leader's forehand above
+        #   every other card of its suit when no other hand can ruff, since the leader's forehand leads every trick
+        # Other hands only win with trumps or by following a suit the leader's forehand still holds
+        # Returns the fewest tricks of each hand, then the most
+        trump = self.trump
+        lows = [0, 0, 0, 0]
+        highs = [0, 0, 0, 0]
+        others_trumps = 0
+        if trump is not None:
+            shift = 13 * trump
+            holdings = [hand >> shift & SUIT_MASK for hand in hands]
+            for hand in range(4):
+                own = holdings[hand]
+                others = (holdings[0] | holdings[1] | holdings[2] | holdings[3]) & ~own
+                lows[hand] = (own >> others.bit_length()).bit_count()
+                highs[hand] = own.bit_count()
+            others_trumps = holdings[1] | holdings[2] | holdings[3]
+        lead = hands[0]
+        for suit in range(4):
+            if suit == trump:
+                continue
+            shift = 13 * suit
+            led = lead >> shift & SUIT_MASK
+            if not led:
+                continue
+            led_count = led.bit_count()
+            holdings = (hands[1] >> shift & SUIT_MASK, hands[2] >> shift & SUIT_MASK, hands[3] >> shift & SUIT_MASK)
+            if not others_trumps:
+                lows[0] += (led >> (holdings[0] | holdings[1] | holdings[2]).bit_length()).bit_count()
+            for hand in range(1, 4):
+                highs[hand] += min(holdings[hand - 1].bit_count(), led_count)
+        total = lows[0] + lows[1] + lows[2] + lows[3]
+        return (lows[0], lows[1], lows[2], lows[3], remaining - total + lows[0], min(highs[1], remaining - total + lows[1]),
+                min(highs[2], remaining - total + lows[2]), min(highs[3], remaining - total + lows[3]))
+
+    def _suit_runs(self, hands, trick):
+        # The runs of the legal cards of the hand to play in each suit, as (lowest card of each run, lowest card of the run of each card)
+        seat = len(trick)
+        hand = hands[seat]
+        live = hands[0] | hands[1] | hands[2] | hands[3]
+        suits = range(4)
+        if seat > 0:
+            for card in trick:
+                live |= 1 << card # cards on the table still decide who wins this trick
+            lead_suit = trick[0] // 13
+            if hand >> 13 * lead_suit & SUIT_MASK:
+                suits = (lead_suit,)
+        suit_runs = []
+        for suit in suits:
+            own = hand >> 13 * suit & SUIT_MASK
+            if own:
+                key = (suit, own, live >> 13 * suit & SUIT_MASK & ~own)
+                runs = _RUNS.get(key)
+                if runs is None:
+                    runs = _RUNS[key] = _runs(*key)
+                suit_runs.append(runs)
+        return suit_runs
+
+    def _moves(self, hands, trick):
+        # The legal cards of the hand to play, one of each run of equivalent cards
+        suit_runs = self._suit_runs(hands, trick)
+        if len(suit_runs) == 1:
+            return list(suit_runs[0][0])
+        return [card for lowest, run_of in suit_runs for card in lowest]
+
+    def _order(self, moves, trick, wins):
+        # Order the cards of a hand following to a trick: first those that give the trick to a hand it helps the side of
+        #   the hand to play, as far as the cards played so far tell, and the cheapest of them first
+        # Leads are left in the order of the moves, cheapest clubs first, which searched fewer positions than leading winners first
+        seat = len(trick)
+        if seat == 0 or len(moves) < 2:
+            return moves
+        bids = self.bids
+        sign = 1 if seat % 2 == 0 else -1
+        gains = (-sign if bids[0] > wins[0] else sign, sign if bids[1] > wins[1] else -sign,
+                 -sign if bids[2] > wins[2] else sign, sign if bids[3] > wins[3] else -sign) # negated, to sort on
+        winner = trick_winner(trick, self.trump)
+        winning_card = trick[winner]
+        winning_suit = winning_card // 13
+        keep, take = gains[winner], gains[seat]
+        if winning_suit == self.trump or self.trump is None:
+            keyed = [(take if card // 13 == winning_suit and card > winning_card else keep, card % 13, card) for card in moves]
+        else:
+            keyed = [(take if card // 13 == self.trump or card // 13 == winning_suit and card > winning_card else keep, card % 13, card)
+                     for card in moves]
+        keyed.sort()
+        return [card for _, _, card in keyed]
+
+    def _search(self, hands, trick, wins, alpha, beta, depth=EXACT):
+        # The score of the position if it is within (alpha, beta), or else a bound on the wrong side of the window
+        # Only depth more tricks are searched, after which the middle of the possible scores stands in for the score
+        self.nodes += 1
+        seat = len(trick)
+        key = None
+        best_card = None
+        if seat == 0:
+            # A hand past its bid loses a point for every further trick, and a hand that needs every trick left gains
+            #   one, whatever its exact count, so positions are scored from the clamped needs plus an offset
+            remaining = hands[0].bit_count()
+            needs = [self.bids[0] - wins[0], self.bids[1] - wins[1], self.bids[2] - wins[2], self.bids[3] - wins[3]]
+            offset = 0
+            for hand in range(4):
+                need = needs[hand]
+                if need < 0:
+                    offset += need if hand % 2 == 0 else -need
+                    needs[hand] = 0
+                elif need > remaining:
+                    offset += remaining - need if hand % 2 == 0 else need - remaining
+                    needs[hand] = remaining
+            if remaining == 1:
+                # Every hand has one card left, so the last trick is already decided
+                winner = trick_winner([hands[0].bit_length() - 1, hands[1].bit_length() - 1, hands[2].bit_length() - 1,
+                                       hands[3].bit_length() - 1], self.trump)
+                needs[winner] -= 1
+                return offset + abs(needs[1]) + abs(needs[3]) - abs(needs[0]) - abs(needs[2])
+            lower, upper = self._score_bounds(needs, remaining)
+            lower += offset
+            upper += offset
+            if lower == upper or lower >= beta:
+                return lower
+            if upper <= alpha:
+                return upper
+            if depth == 0:
+                return lower + (upper - lower) // 4 * 2 # every score left has the same parity
+            depth = min(depth, remaining)
+            key = (_suit_key(hands, 0), _suit_key(hands, 13), _suit_key(hands, 26), _suit_key(hands, 39), needs[0], needs[1], needs[2], needs[3])
+            entry = self.table.get(key)
+            if entry is not None:
+                lower, upper, best_card, searched = entry
+                if searched >= depth: # bounds from a shallower search only help order the moves
+                    lower += offset
+                    upper += offset
+                    if lower == upper or lower >= beta:
+                        return lower
+                    if upper <= alpha:
+                        return upper
+                    alpha, beta = max(alpha, lower), min(beta, upper)
+            else:
+                # Limits on each hand's tricks cost more to find, so they are only worth it for positions new to the table
+                lower, upper = self._score_bounds(needs, remaining, self._trick_limits(hands, remaining))
+                lower += offset
+                upper += offset
+                if lower == upper or lower >= beta:
+                    return lower
+                if upper <= alpha:
+                    return upper
+        window = (alpha, beta)
+
+        moves = self._order(self._moves(hands, trick), trick, wins)
+        if best_card in moves:
+            moves.remove(best_card)
+            moves.insert(0, best_card)
+
+        maximizing = seat % 2 == 0 # the leader plays the first and third card of every trick
+        best = -1000 if maximizing else 1000
+        for card in moves:
+            bit = 1 << card
+            hands[seat] ^= bit
+            trick.append(card)
+            if seat == 3:
+                winner = trick_winner(trick, self.trump)
+                wins[winner] += 1
+                value = self._search(hands, [], wins, alpha, beta, depth - 1)
+                wins[winner] -= 1
+            else:
+                value = self._search(hands, trick, wins, alpha, beta, depth)
+            trick.pop()
+            hands[seat] ^= bit
+
+            if maximizing:
+                if value > best:
+                    best, best_card = value, card
+                    alpha = max(alpha, value)
+            elif value < best:
+                best, best_card = value, card
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+
+        # Keep what the search proved about the position, merged with what was known before
+        # A deeper search's entry is kept over a shallower one
+        entry = self.table.get(key) if key is not None else None
+        if key is not None and (entry is None or entry[3] <= depth):
+            lower, upper = entry[:2] if entry is not None and entry[3] == depth else (-1000, 1000)
+            if best <= window[0]:
+                upper = min(upper, best - offset)
+            elif best >= window[1]:
+                lower = max(lower, best - offset)
+            else:
+                lower = upper = best - offset
+            self.table[key] = (lower, upper, best_card, depth)
+        return best
+
+    def _mtdf(self, hands, trick, wins, guess=0, depth=EXACT):
+        # The score, found by null-window searches that close in on it, which the table makes cheap to repeat
+        lower, upper = -1000, 1000
+        score = guess
+        while lower < upper:
+            beta = score + 1 if score == lower else score
+            score = self._search(list(hands), list(trick), list(wins), beta - 1, beta, depth)
+            if score < beta:
+                upper = score
+            else:
+                lower = score
+        return score
+
+    def _deepen(self, hands, trick, wins):
+        # The exact score, found by MTD(f), after MTD(f) searches one trick deeper at a time if deepen is set,
+        #   each starting from the score of the one before and trying first the best cards it found
+        score = 0
+        if self.deepen:
+            for depth in range(1, hands[3].bit_count()):
+                score = self._mtdf(hands, trick, wins, score, depth)
+        return self._mtdf(hands, trick, wins, score)
+
+    def _play(self, hands, trick, wins, card):
+        # Play a card, returning the next trick
+        seat = len(trick)
+        hands[seat] ^= 1 << card
+        trick = trick + [card]
+        if seat == 3:
+            wins[trick_winner(trick, self.trump)] += 1
+            trick = []
+        return trick
+
+    def solve(self, position):
+        """
+        Solve a position.
+
+        Args:
+            position (Position or TennisEnv): A trick-play position, or an environment in one.
+
+        Returns:
+            dict: The "score" of perfect play (the dealer's bid error minus the leader's), the final "wins" of each hand
+                  (as named in HANDS) and the "leader_error" and "dealer_error" along one line of perfect play,
+                  and the number of "nodes" searched.
+        """
+        if isinstance(position, TennisEnv):
+            position = position_from_env(position)
+        self._prepare(position)
+        nodes = self.nodes
+        hands, trick, wins = list(position.hands), list(position.trick), list(position.wins)
+        score = self._deepen(hands, trick, wins)
+
+        # Follow a line of perfect play to the end, to find how many tricks each hand takes
+        while hands[len(trick)]:
+            for card in self._moves(hands, trick):
+                next_hands, next_wins = list(hands), list(wins)
+                next_trick = self._play(next_hands, trick, next_wins, card)
+                if self._search(list(next_hands), list(next_trick), list(next_wins), score - 1, score + 1) == score:
+                    hands, trick, wins = next_hands, next_trick, next_wins
+                    break
+
+        leader_error, dealer_error = bid_errors(wins, position.bids)
+        return {"score": score, "wins": dict(zip(HANDS, wins)), "leader_error": leader_error,
+                "dealer_error": dealer_error, "nodes": self.nodes - nodes}
+
+    def card_scores(self, position):
+        """
+        Score every legal card of the hand to play.
+
+        Args:
+            position (Position or TennisEnv): A trick-play position, or an environment in one.
+
+        Returns:
+            dict: The score of perfect play after each legal card, by card index (the Card.action_index).
+        """
+        if isinstance(position, TennisEnv):
+            position = position_from_env(position)
+        self._prepare(position)
+        hands, trick = list(position.hands), list(position.trick)
+        scores = {}
+        for lowest, run_of in self._suit_runs(hands, trick):
+            for card in lowest:
+                next_hands, next_wins = list(hands), list(position.wins)
+                next_trick = self._play(next_hands, trick, next_wins, card)
+                scores[card] = self._deepen(next_hands, next_trick, next_wins)
+            # Equivalent cards score the same as the one searched
+            for card, lowest_card in run_of.items():
+                scores[card] = scores[lowest_card]
+        return scores
+
+    def best_card(self, position):
+        """Return the card index of a best card for the hand to play, and the score it leads to."""
+        if isinstance(position, TennisEnv):
+            position = position_from_env(position)
+        self._prepare(position)
+        hands, trick, wins = list(position.hands), list(position.trick), list(position.wins)
+        score = self._deepen(hands, trick, wins)
+        # The first card whose null-window search around the score reaches it is a best card
+        for card in self._order(self._moves(hands, trick), trick, wins):
+            next_hands, next_wins = list(hands), list(wins)
+            next_trick = self._play(next_hands, trick, next_wins, card)
+            if self._search(next_hands, next_trick, next_wins, score - 1, score + 1) == score:
+                return card, score
+
+    # return the best legal action from the current environment, like DQN.choose_action
+    def choose_action(self, env):
+        if env.dealer.forehand_bid["card"] is None or len(env.dealer.backhand) > self.solve_tricks: # the last hand to play holds a card for each trick left
+            if self.fallback is not None:
+                return self.fallback.choose_action(env)
+            move_index = random.choice(env.legal_action_mask().nonzero().flatten().tolist())
+            return torch.tensor([[move_index]], dtype=torch.long)
+        card, score = self.best_card(env)
+        return torch.tensor([[env.card_action(card)]], dtype=torch.long)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tricks", type=int, default=6, help="The tricks left in each solved position, from 1 to 12")
+    parser.add_argument("--deals", type=int, default=20, help="The number of random deals to solve")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the deals and of the random moves before the position")
+    parser.add_argument("--deepen", action="store_true", help="Search one trick deeper at a time before the exact search")
+    args = parser.parse_args()
+    assert 1 <= args.tricks <= 12, "tricks must be from 1 to 12"
+
+    random.seed(args.seed)
+    solver = DoubleDummySolver(deepen=args.deepen)
+    env = TennisEnv(None, None)
+    times = []
+    for deal in range(args.deals):
+        # Make the bids and play the first tricks at random
+        env.reset()
+        for _ in range(4 + 4 * (12 - args.tricks)):
+            env.step_helper(random.choice(env.legal_action_mask().nonzero().flatten().tolist()))
+        start = time.perf_counter()
+        result = solver.solve(env)
+        times.append(time.perf_counter() - start)
+        print(f"Deal {deal}: score {result['score']:+d}, leader error {result['leader_error']}, "
+              f"dealer error {result['dealer_error']}, {result['nodes']} nodes, {times[-1]:.3f}s")
+    print(f"Mean time {sum(times) / len(times):.3f}s, max {max(times):.3f}s")
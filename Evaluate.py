@@ -1,81 +1,44 @@
-import sys, argparse
-from TennisEnv import TennisEnv
-from TennisQNet import TennisLeaderQNetwork
-from TennisQNet import TennisDealerQNetwork
-from GeneralDQN import DQN
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--leader", default=None, help="The leader model (.pt) (optional)")
-parser.add_argument("--dealer", default=None, help="The dealer model (.pt) (optional)")
-args = parser.parse_args()
-
-# Leader
-leader = DQN(TennisLeaderQNetwork)
-if args.leader:
-    leader.load_model(args.leader)
-    print("Loading leader model")
-
-# Dealer
-dealer = DQN(TennisDealerQNetwork)
-if args.dealer:
-    dealer.load_model(args.dealer)
-    print("Loading dealer model")
-
-# Environment
-environment = TennisEnv(leader, dealer, rewarded_player="leader")
-
-num_games = 200
-
-verbose = False
-
-total_reward = 0  # Initialize the total reward to zero
-
-# Track wins and loses
-leader_wins = 0
-dealer_wins = 0
-games_tied = 0
-environment.set_seed()
-# Play many games
-for i in range(num_games):
-    # Print the progress of the current game
-    print(f"Progress {(i + 1)/num_games:.1%}", end="\r")
-        
-    # Reset the environment for a new game
-    environment.reset()
-    if verbose:
-        environment.render()
-
-    while True:
-        # Leader
-        leader_action = leader.choose_action(environment)
-        environment.step_helper(leader_action)
-        if verbose:
-            environment.render()
-        if environment.done:
-            break
-
-        # Dealer
-        dealer_action = dealer.choose_action(environment)
-        environment.step_helper(dealer_action)
-        if verbose:
-            environment.render()
-        if environment.done:
-            break
-        
-    total_reward += environment.reward # Accumulate the reward
-
-    # Track wins and loses
-    if environment.winner == "leader":
-        leader_wins += 1
-    elif environment.winner == "dealer":
-        dealer_wins += 1
-    else:
-        games_tied += 1
-
-# Calculate and print the average reward
-average_reward = total_reward / num_games
-leader_win_rate = leader_wins / num_games
-dealer_win_rate = dealer_wins / num_games
-tie_rate = games_tied / num_games
-print(f"Average error difference over {num_games} games: {24*average_reward:.3f} (positive is good for leader)")
-print(f"Leader win/dealer win/tie rate: {leader_win_rate:.1%}/{dealer_win_rate:.1%}/{tie_rate:.1%}")
\ No newline at end of file
+import argparse
+from contextlib import nullcontext
+from Tournament import run_tournament, summarize
+from DealBank import DealBank
+from Profiler import PROFILER, profile_run
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leader", default=None, help="The leader model (.pt) or exported policy, see InferencePolicy.py (optional)")
+    parser.add_argument("--dealer", default=None, help="The dealer model (.pt) or exported policy, see InferencePolicy.py (optional)")
+    parser.add_argument("--baseline_leader", default="random", help="The leader of the duplicate table (.pt), or \"random\" (optional)")
+    parser.add_argument("--baseline_dealer", default="random", help="The dealer of the duplicate table (.pt), or \"random\" (optional)")
+    parser.add_argument("--deals", type=int, default=10000, help="The number of deals, each played at both tables")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the deals")
+    parser.add_argument("--deal_bank", default=None, help="A deal bank (.npy) to take the deals from instead, see DealBank.py (optional)")
+    parser.add_argument("--workers", type=int, default=None, help="The number of worker processes (default: all cores)")
+    parser.add_argument("--concurrent_games", type=int, default=1,
+                        help="Play each worker's deals as separate games in this many threads, with moves batched by an InferenceServer (optional)")
+    parser.add_argument("--shard_size", type=int, default=500, help="The number of deals each worker plays at once")
+    parser.add_argument("--profile", nargs="?", const="outputs/evaluate", default=None,
+                        help="Play in this process and write a cProfile (.prof) and collapsed-stack (.folded) profile with this path prefix")
+    args = parser.parse_args()
+
+    # Profiling plays every deal in this process, so the profiles see the games
+    with profile_run(args.profile) if args.profile else nullcontext():
+        results = run_tournament(args.leader, args.dealer, args.baseline_leader, args.baseline_dealer,
+                                 num_deals=args.deals, seed=args.seed, workers=0 if args.profile else args.workers,
+                                 shard_size=args.shard_size, deal_bank=DealBank(args.deal_bank) if args.deal_bank else None,
+                                 concurrent_games=args.concurrent_games)
+    if args.profile:
+        print(PROFILER.format_report(PROFILER.window_report()))
+    stats = summarize(results)
+
+    # Print the results with 95% confidence intervals
+    def interval(key, percent=False):
+        mean, half_width = stats[key]
+        if percent:
+            return f"{mean:.1%} ± {half_width:.1%}"
+        return f"{mean:.3f} ± {half_width:.3f}"
+
+    print(f"Average error difference over {args.deals} deals: {interval('error_difference')} (positive is good for leader)")
+    print(f"Duplicate error difference against the baseline table: {interval('duplicate_error_difference')}")
+    print(f"Leader win/dealer win/tie rate: {interval('leader_win_rate', percent=True)}/"
+          f"{interval('dealer_win_rate', percent=True)}/{interval('draw_rate', percent=True)}")
@@ -0,0 +1,179 @@
+# This script keeps finished Tennis games in a compact, append-only binary log.
+# A log is a 16-byte header followed by fixed-size records, one per game, so it can be streamed or memory-mapped.
+# Each record holds the deal, the trump flag, the 52 cards played, the final bids and wins,
+#   and optionally the Q-value of the greedy move at each ply.
+
+# Standard library imports
+import os, struct
+
+# Third-party imports
+import numpy
+
+# Local imports
+from TennisEnv import TennisEnv
+
+MAGIC = b"TENNISLG"
+VERSION = 1
+HEADER = struct.Struct("<8sHHI") # magic, version, flags, record size
+FLAG_Q_VALUES = 1
+
+# Hands are listed as in the state: leader forehand, leader backhand, dealer forehand, dealer backhand
+RECORD_FIELDS = [
+    ("deal", numpy.uint8, (52,)), # the card indices in the order they are dealt (see VecTennisEnv.DEAL_SLICES)
+    ("trump", numpy.bool_), # True if spades are trump
+    ("plays", numpy.uint8, (52,)), # the card index played at each ply: four bids, then twelve tricks
+    ("bids", numpy.uint8, (4,)), # the value of each hand's bid
+    ("wins", numpy.uint8, (4,)), # the tricks won by each hand
+]
+Q_VALUE_FIELD = ("q_values", numpy.float16, (52,)) # the greedy Q-value at each ply, NaN where the move was random
+
+def record_dtype(q_values=False):
+    """Return the numpy dtype of one record."""
+    return numpy.dtype(RECORD_FIELDS + [Q_VALUE_FIELD] if q_values else RECORD_FIELDS)
+
+def _read_header(file, path):
+    magic, version, flags, record_size = HEADER.unpack(file.read(HEADER.size))
+    assert magic == MAGIC and version == VERSION, f"{path} is not a game log"
+    dtype = record_dtype(bool(flags & FLAG_Q_VALUES))
+    assert dtype.itemsize == record_size, f"{path} has records of an unknown layout"
+    return dtype
+
+def fill_record(record, environment, q_values=False):
+    """Write the game a TennisEnv just finished into a record of record_dtype(q_values)."""
+    record["deal"] = environment.deal
+    record["trump"] = environment.trump_suit == 'S'
+    record["plays"] = [card.action_index for card in environment.game_record]
+    leader, dealer = environment.leader, environment.dealer
+    record["bids"] = [leader.forehand_bid["value"], leader.backhand_bid["value"], dealer.forehand_bid["value"], dealer.backhand_bid["value"]]
+    record["wins"] = [leader.forehand_wins, leader.backhand_wins, dealer.forehand_wins, dealer.backhand_wins]
+    if q_values:
+        record["q_values"] = environment.q_record
+
+class GameRecorder:
+    """
+    GameRecorder appends every game a TennisEnv finishes to a game log.
+
+    Records are collected in a preallocated buffer and written buffer_size at a time. Pass the recorder to
+    TennisEnv as recorder=, and call close (or use it as a context manager) to write the last games.
+
+    Attributes:
+        path (str): The game log file.
+        q_values (bool): Whether the records hold per-ply Q-values.
+        games (int): The number of games recorded by this recorder.
+    """
+    def __init__(self, path, q_values=False, buffer_size=4096):
+        self.path = path
+        self.q_values = q_values
+        self.dtype = record_dtype(q_values)
+        self.buffer = numpy.zeros(buffer_size, dtype=self.dtype)
+        self.buffered = 0
+        self.games = 0
+
+        # Append to an existing log, which must have the same layout
+        # A crash in the middle of a write can leave part of a record at the end, which is cut off so that
+        #   the records appended after it stay aligned
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            with open(path, "rb") as file:
+                assert _read_header(file, path) == self.dtype, f"{path} was recorded with q_values={not q_values}"
+            size = os.path.getsize(path)
+            partial = (size - HEADER.size) % self.dtype.itemsize
+            if partial:
+                print(f"Cutting off {partial} bytes of a partly written record at the end of {path}")
+                os.truncate(path, size - partial)
+            self.file = open(path, "ab")
+        else:
+            self.file = open(path, "wb")
+            self.file.write(HEADER.pack(MAGIC, VERSION, FLAG_Q_VALUES if q_values else 0, self.dtype.itemsize))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, environment):
+        """Buffer the game the environment just finished."""
+        fill_record(self.buffer[self.buffered], environment, self.q_values)
+        self._advance()
+
+    def append(self, record):
+        """Buffer a record made elsewhere, such as by a LastGameRecorder in an actor process."""
+        self.buffer[self.buffered] = record
+        self._advance()
+
+    def _advance(self):
+        self.buffered += 1
+        self.games += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the file."""
+        self.file.write(self.buffer[:self.buffered].tobytes())
+        self.file.flush()
+        self.buffered = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+class LastGameRecorder:
+    """
+    LastGameRecorder keeps the record of the last game a TennisEnv finished instead of writing it.
+
+    Pass it to TennisEnv as recorder= in a process that cannot write to the game log, such as a self-play actor,
+    and send the record to the process that can, for GameRecorder.append.
+
+    Attributes:
+        q_values (bool): Whether the record holds per-ply Q-values.
+        last (numpy.ndarray): The 0-d record of the last finished game.
+    """
+    def __init__(self, q_values=False):
+        self.q_values = q_values
+        self.last = numpy.zeros((), dtype=record_dtype(q_values))
+
+    def record(self, environment):
+        fill_record(self.last, environment, self.q_values)
+
+def open_game_log(path):
+    """Memory-map a game log for random access to its records."""
+    with open(path, "rb") as file:
+        dtype = _read_header(file, path)
+    return numpy.memmap(path, dtype=dtype, mode="r", offset=HEADER.size)
+
+def read_game_log(path, chunk_size=4096):
+    """
+    Stream the records of a game log, chunk_size at a time.
+
+    Yields:
+        numpy.ndarray: Up to chunk_size records.
+    """
+    with open(path, "rb") as file:
+        dtype = _read_header(file, path)
+        while True:
+            data = file.read(dtype.itemsize * chunk_size)
+            records = numpy.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype=dtype)
+            if len(records) == 0:
+                return
+            yield records
+
+def replay(record, environment=None, plies=52):
+    """
+    Replay a recorded game into a TennisEnv.
+
+    Args:
+        record (numpy.void): One record of a game log.
+        environment (TennisEnv, optional): The environment to replay into, which must reward the leader,
+                                           so that reset does not make a move. A new one is made if not given.
+        plies (int): The number of moves to replay, 52 for the whole game.
+
+    Returns:
+        TennisEnv: The environment after the given number of moves.
+    """
+    if environment is None:
+        environment = TennisEnv(None, None, rewarded_player="leader")
+    environment.reset(deal=(record["deal"].tolist(), bool(record["trump"])))
+    for card_index in record["plays"][:plies].tolist():
+        environment.step_helper(environment.card_action(card_index))
+    return environment
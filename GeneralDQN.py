@@ -2,14 +2,20 @@
 # You just need to make the environment and the Q-network
 
 # Standard Library Imports
-import random, math, datetime, os
-from collections import namedtuple, deque
+import random, math, datetime, os, queue, threading
+from collections import namedtuple
 from itertools import count
 
 # Thir- Party Library Imports
 import torch
 from torch.utils.tensorboard import SummaryWriter
 
+# Local Imports
+from VecTennisEnv import VecTennisEnv
+from Checkpoint import CheckpointWriter, clone_tensors, read_checkpoint, checkpoint_on_signals
+from GameLog import LastGameRecorder
+from Profiler import PROFILER
+
 # Check if GPU is available and set the device accordingly
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
@@ -20,11 +26,10 @@ torch.manual_seed(SEED)
 if torch.cuda.is_available():
     torch.cuda.manual_seed_all(SEED)
 
+# Games between validation checkpoints
+VALIDATION_FREQUENCY = 1000
+
 class DQN():
-    # Define a named tuple 'Transition' to represent a single transition in our environment.
-    # It essentially maps (state, action) pairs to their (next_state, reward) result.
-    Transition = namedtuple('Transition', ('state', 'action', 'next_state', 'reward'))
-    
     def __init__(self, qNetwork, hyperparameters):
         # Hyperparameters
         self.BATCH_SIZE = 200
@@ -36,7 +41,13 @@ class DQN():
         self.GRAD_CLIP_MIN = -10
         self.GRAD_CLIP_MAX = 10
         self.TAU = 0.005 # The rate to update the target net
+        self.TARGET_UPDATE = hyperparameters.get("TARGET_UPDATE", "soft") # "soft" blends in TAU of the policy net, "hard" copies it
+        self.TARGET_UPDATE_INTERVAL = hyperparameters.get("TARGET_UPDATE_INTERVAL", 1) # Optimization steps between target updates
         self.MEMORY_LENGTH = 100000 # Maximim transitions to be remembered
+        self.PRIORITIZED_REPLAY = hyperparameters.get("PRIORITIZED_REPLAY", False) # Sample transitions by TD error
+        self.PER_ALPHA = 0.6 # How much the TD error decides the sampling priority
+        self.PER_BETA_START = 0.4 # The importance-sampling correction, annealed to 1
+        self.PER_BETA_STEPS = 1e6 # The steps until the correction is complete
 
         # Model settings
         self.TRAINEE = "dealer"
@@ -47,13 +58,22 @@ class DQN():
         self.policy_net = qNetwork().to(device)
         self.target_net = qNetwork().to(device)
         self.target_net.load_state_dict(self.policy_net.state_dict())
+        assert self.TARGET_UPDATE in ["soft", "hard"], "TARGET_UPDATE must be either 'soft' or 'hard'"
+        self.target_update_steps = 0
+
+        # The tensors the target update blends, which stay the same objects when weights are loaded
+        self.policy_tensors = [t for t in list(self.policy_net.parameters()) + list(self.policy_net.buffers()) if t.is_floating_point()]
+        self.target_tensors = [t for t in list(self.target_net.parameters()) + list(self.target_net.buffers()) if t.is_floating_point()]
         
         num_parameters = sum(p.numel() for p in self.policy_net.parameters() if p.requires_grad)
         print(f"Created a {qNetwork.__name__} model with {num_parameters} parameters")
 
         # Optimization and Memory
         self.optimizer = torch.optim.AdamW(self.policy_net.parameters(), lr=self.LR, amsgrad=True)
-        self.memory = ReplayMemory(self.MEMORY_LENGTH)
+        if self.PRIORITIZED_REPLAY:
+            self.memory = PrioritizedReplayMemory(self.MEMORY_LENGTH, self.PER_ALPHA)
+        else:
+            self.memory = ReplayMemory(self.MEMORY_LENGTH)
 
         # Logging
         log_dir = "logs"
@@ -67,7 +87,13 @@ class DQN():
         self.running_losses = RunningAverage(max_length=400)
         self.best_validation_score = float('-inf')
         self.VALIDATION_GAMES = 400
-        self.VALIDATION_FREQUENCY = 1000
+        self.VALIDATION_FREQUENCY = VALIDATION_FREQUENCY
+        self.LOSS_FREQUENCY = 1000 # Games between estimates of the loss on the held-out transitions
+        self.LOSS_SNAPSHOT_SIZE = 5000 # Transitions kept out of the replay memory to estimate the loss
+        self.HOLD_OUT_FREQUENCY = 10 # Every this many games, one is held out until there are LOSS_SNAPSHOT_SIZE transitions
+        self.held_out = ReplayMemory(self.LOSS_SNAPSHOT_SIZE) # never sampled for training
+        self.validation_loss = None
+        self.last_validation = None # The (wins, reward, loss) of the latest validation checkpoint
         self.checkpoint_save_name = None
         self.OUTPUT_PATH = "outputs"
         self.LJUST_LENGTH = 150
@@ -78,136 +104,331 @@ class DQN():
         self.best_score = None
         self.stop = False
 
+        # Checkpoints
+        self.CHECKPOINT_FREQUENCY = hyperparameters.get("CHECKPOINT_FREQUENCY", 5000) # Games between checkpoints, 0 to only save on signals
+        self.games_done = 0
+        self.next_deals = None # the deal bank index the environment (or each actor) plays next, so a resumed run goes on from there
+        self.checkpoint_path = None # defaults to a path built from the save name and hyperparameters
+        self.checkpoint_request = None # set by a signal handler, True to stop training after the checkpoint
+        self.checkpoint_writer = None
+
     # Main training loop to train the Q-network using the Tennis environment
     def train(self, environment, save_name, games=-1):
         self.checkpoint_save_name = save_name
 
+        # Go on through the deal bank from where a resumed run stopped
+        if self.next_deals:
+            environment.next_deal = max(self.next_deals)
+
         # Iterate over each episode
         #for i_episode in range(num_episodes):
         game = 0
-        while game < games or games < 1:
-            game += 1
+        with checkpoint_on_signals(self.request_checkpoint):
+            while game < games or games < 1:
+                game += 1
+                self.games_done += 1
             
-            # Reset the environment and initialize variables
-            state = environment.reset()
-
-            # Iterate over each step in the episode
-            for t in count():
-                # Select an action based on the current state
-                action = self.epsilon_greedy_policy(environment)
+                # Reset the environment and initialize variables
+                with PROFILER.phase("simulation"):
+                    state = environment.reset()
+                memory = self.held_out if self.holding_out() else self.memory
+
+                # Iterate over each step in the episode
+                for t in count():
+                    # Select an action based on the current state
+                    with PROFILER.phase("action selection"):
+                        action = self.epsilon_greedy_policy(environment)
                 
-                # Take the selected action in the environment
-                next_state, reward, done, exit_cond = environment.step(action.item())
+                    # Take the selected action in the environment
+                    next_state, reward, done, exit_cond = environment.step(action.item())
                 
-                # If the episode is done, set the next state to None
-                if done:
-                    next_state = None
-
-                # Store the transition in the replay memory
-                self.memory.push(state.unsqueeze(0), action, next_state.unsqueeze(0) if next_state is not None else None, reward)
+                    # If the episode is done, set the next state to None
+                    if done:
+                        next_state = None
+
+                    # Store the transition in the replay memory, or with the held-out transitions
+                    with PROFILER.phase("replay memory"):
+                        memory.push(state.unsqueeze(0), action, next_state.unsqueeze(0) if next_state is not None else None, reward)
+                    PROFILER.count("steps")
                 
-                # Move to the next state
-                state = next_state
+                    # Move to the next state
+                    state = next_state
 
-                # Optimize the Q-network based on the stored experiences
-                self.optimize_model()
+                    # Optimize the Q-network based on the stored experiences
+                    with PROFILER.phase("optimize"):
+                        self.optimize_model()
                 
-                # Soft update of the target network's weights
-                target_net_state_dict = self.target_net.state_dict()
-                policy_net_state_dict = self.policy_net.state_dict()
-                for key in policy_net_state_dict:
-                    target_net_state_dict[key] = policy_net_state_dict[key]*self.TAU + target_net_state_dict[key]*(1-self.TAU)
-                self.target_net.load_state_dict(target_net_state_dict)
-
-                # If the episode is done, stop
-                if done:
-                    break
+                    # Soft update of the target network's weights
+                    with PROFILER.phase("target update"):
+                        self.update_target_net()
 
-            self.running_rewards.append(reward)
-            if environment.winner == environment.rewarded_player:
-                self.running_wins.append(1)
-            else:
-                self.running_wins.append(0)
-
-            # Display the training progress
-            progress_str = f"Training: {game % self.VALIDATION_FREQUENCY}/{self.VALIDATION_FREQUENCY}"
-            print(progress_str.ljust(self.LJUST_LENGTH), end="\r")
-
-            # Validation
-            if game % self.VALIDATION_FREQUENCY == 0:
-                val_wins, val_reward, val_loss = self.validate(environment)
-
-                current_datetime = datetime.datetime.now()
-                formatted_datetime = current_datetime.strftime("%Y-%m-%d %H:%M:%S")
-                wins_str = f"Avg Wins: {custom_round(val_wins, 3)}"
-                reward_str = f"Avg reward: {custom_round(val_reward, 3)}"
-                loss_str = f"Avg loss: {custom_round(val_loss, 3)}"
-                step_str = f"Step: {self.steps_done}"
-                eps_str = f"Eps threshold: {self.eps_threshold:.2%}"
-
-                display_str = f"{formatted_datetime}, {wins_str}, {reward_str}, {loss_str}, {step_str}, {eps_str}"
-                print(display_str.ljust(self.LJUST_LENGTH), end="")
-
-                if val_reward > self.best_validation_score:
-                    self.best_validation_score = val_reward
-                    save_name = f"{self.checkpoint_save_name}_{self.LR}_{self.EPS_DECAY}"
-                    self.save_model(os.path.join(self.OUTPUT_PATH, save_name))
-                    print(f"\nNew best model found, saving to {save_name}", end="")
-                print()
-                
-                # Early Stopping
-                if self.best_score is None:
-                    self.best_score = val_reward
-                elif val_reward > self.best_score:  # Maximize reward
-                    self.best_score = val_reward
-                    self.counter = 0
-                else:
-                    self.counter += 1
-                    if self.counter >= self.PATIENCE:
-                        print("Early stopping triggered at step {self.steps_done}, no improvements after {self.PATIENCE}")
+                    # If the episode is done, stop
+                    if done:
                         break
 
-    # runs a few games with epsilon set to zero (no random moves)
-    def validate(self, environment):
-        total_wins = 0
-        total_reward = 0
-        total_loss = 0
-        validation_steps = 0
-        for v in range(self.VALIDATION_GAMES):
-            print(f"Validating {v}/{self.VALIDATION_GAMES}".ljust(self.LJUST_LENGTH), end="\r")
-            # Reset the environment and initialize variables
-            environment.reset()
-
-            # Iterate over each step in the episode
-            for t in count():
-                # Select an action based on the current state
-                action = self.choose_action(environment)
-                
-                # Take the selected action in the environment
-                next_state, reward, done, exit_cond = environment.step(action.item())
-                
-                # Get loss
-                total_loss += self.optimize_model(optimize=False).item()
-                
-                
-                # If the episode is done, stop
-                if done:
-                    validation_steps += t
-                    total_reward += environment.reward
+                PROFILER.count("games")
+                self.next_deals = [environment.next_deal]
+                with PROFILER.phase("logging"):
+                    self.running_rewards.append(reward)
+                    if environment.winner == environment.rewarded_player:
+                        self.running_wins.append(1)
+                    else:
+                        self.running_wins.append(0)
+
+                    # Display the training progress
+                    progress_str = f"Training: {game % self.VALIDATION_FREQUENCY}/{self.VALIDATION_FREQUENCY}"
+                    print(progress_str.ljust(self.LJUST_LENGTH), end="\r")
+
+                    # Loss estimate
+                    if game % self.LOSS_FREQUENCY == 0:
+                        self.estimate_loss()
+
+                # Validation
+                if game % self.VALIDATION_FREQUENCY == 0:
+                    if self.validation_checkpoint(environment):
+                        break
+
+                # Checkpoint
+                with PROFILER.phase("checkpoint"):
+                    stop = self.checkpoint_if_due()
+                if stop:
                     break
+        self.flush_checkpoints()
+
+    # Trains with several self-play actor processes, while this process learns from their games
+    # Actors reload the policy weights every sync_interval optimization steps
+    def train_parallel(self, environment, save_name, games=-1, num_actors=4, sync_interval=100, queue_depth=64):
+        self.checkpoint_save_name = save_name
+        context = torch.multiprocessing.get_context("spawn")
 
-            # Track wins
-            if environment.winner == environment.rewarded_player:
-                total_wins += 1
+        # The policy weights the actors copy from, kept in shared memory
+        shared_net = type(self.policy_net)()
+        shared_net.load_state_dict(self.policy_net.state_dict())
+        shared_net.share_memory()
+        weights_version = context.Value('l', 0)
+        eps_threshold = context.Value('d', self.get_eps_threshold())
+
+        transition_queue = context.Queue(maxsize=queue_depth)
+        stop_event = context.Event()
+
+        # The opponent is frozen, so the actors only need its weights once
+        if environment.rewarded_player == "leader":
+            opponent = environment.dealer_q_network
+        else:
+            opponent = environment.leader_q_network
+        opponent_state_dict = {key: value.cpu() for key, value in opponent.policy_net.state_dict().items()}
+
+        # With a deal bank, each actor plays its own stretch of the remaining deals, or goes on from where it
+        #   stopped in a resumed run with as many actors (otherwise new stretches start after the furthest deal played)
+        deal_bank = environment.deal_bank
+        if self.next_deals and len(self.next_deals) != num_actors:
+            environment.next_deal = max(self.next_deals)
+        if deal_bank is not None and not (self.next_deals and len(self.next_deals) == num_actors):
+            stride = (len(deal_bank) - environment.next_deal) // num_actors
+            self.next_deals = [environment.next_deal + actor_id * stride for actor_id in range(num_actors)]
+
+        # Actors cannot share the game log, so they send each game's record with it
+        recorder = LastGameRecorder(environment.recorder.q_values) if environment.recorder is not None else None
+
+        actors = []
+        for actor_id in range(num_actors):
+            actor = context.Process(target=run_actor, daemon=True, args=(
+                type(environment), environment.rewarded_player, type(self.policy_net), type(opponent.policy_net),
+                opponent_state_dict, shared_net, weights_version, eps_threshold, transition_queue, stop_event,
+                SEED + actor_id + 1, actor_id, deal_bank, environment.first_deal, self.next_deals[actor_id] if deal_bank is not None else 0, recorder))
+            actor.start()
+            actors.append(actor)
+
+        # A thread moves the games to this process, so the learner can check on the actors while it waits
+        games_ready = queue.Queue(maxsize=queue_depth)
+        relay = threading.Thread(target=relay_queue, args=(transition_queue, games_ready, stop_event), daemon=True)
+        relay.start()
+
+        game = 0
+        updates = 0
+        with checkpoint_on_signals(self.request_checkpoint):
+            try:
+                while game < games or games < 1:
+                    # Wait for games while there are too few transitions to learn from
+                    stop = False
+                    check_actors(actors)
+                    games_waiting = drain_queue(games_ready, block=len(self.memory) < self.BATCH_SIZE, actors=actors)
+                    while True:
+                        with PROFILER.phase("waiting for actors"):
+                            game_arrays = next(games_waiting, None)
+                        if game_arrays is None:
+                            break
+                        states, actions, next_states, rewards = map(torch.from_numpy, game_arrays[:4])
+                        won, actor_id, next_deal, record = game_arrays[4:8]
+                        if deal_bank is not None:
+                            self.next_deals[actor_id] = next_deal
+                        if record is not None:
+                            environment.recorder.append(record)
+                        game += 1
+                        self.games_done += 1
+
+                        # Only the last transition of a game is final
+                        with PROFILER.phase("replay memory"):
+                            dones = torch.zeros(len(actions), dtype=torch.bool)
+                            dones[-1] = True
+                            memory = self.held_out if self.holding_out() else self.memory
+                            memory.push_batch(states, actions.view(-1, 1), next_states, rewards, dones)
+                        self.steps_done += len(actions)
+                        self.eps_threshold = self.get_eps_threshold()
+                        PROFILER.count("steps", len(actions))
+                        PROFILER.count("games")
+
+                        with PROFILER.phase("logging"):
+                            self.running_rewards.append(rewards[-1].item())
+                            self.running_wins.append(1 if won else 0)
+
+                            # Display the training progress
+                            progress_str = f"Training: {game % self.VALIDATION_FREQUENCY}/{self.VALIDATION_FREQUENCY}"
+                            print(progress_str.ljust(self.LJUST_LENGTH), end="\r")
+
+                            # Loss estimate
+                            if game % self.LOSS_FREQUENCY == 0:
+                                self.estimate_loss()
+
+                        # Validation
+                        if game % self.VALIDATION_FREQUENCY == 0 and self.validation_checkpoint(environment):
+                            stop = True
+                            break
+
+                        # Checkpoint
+                        with PROFILER.phase("checkpoint"):
+                            stop = self.checkpoint_if_due()
+                        if stop:
+                            break
+                        if game == games:
+                            break
+                    if stop:
+                        break
+                    eps_threshold.value = self.eps_threshold
+
+                    # Optimize the Q-network and the target network
+                    with PROFILER.phase("optimize"):
+                        self.optimize_model()
+                    with PROFILER.phase("target update"):
+                        self.update_target_net()
+                    updates += 1
+
+                    # Publish the new weights to the actors
+                    if updates % sync_interval == 0:
+                        with PROFILER.phase("weight sync"), weights_version.get_lock():
+                            for shared_param, param in zip(shared_net.parameters(), self.policy_net.parameters()):
+                                shared_param.data.copy_(param.data)
+                            weights_version.value += 1
+            finally:
+                stop_event.set()
+                relay.join(timeout=5)
+                for _ in drain_queue(transition_queue, block=False):
+                    pass
+                for actor in actors:
+                    actor.join(timeout=5)
+                    if actor.is_alive():
+                        actor.terminate()
+            self.flush_checkpoints()
+
+    # Validates the model, saves it if it is the best so far, and returns True if training should stop early
+    def validation_checkpoint(self, environment):
+        # Throughput and time shares since the last validation (the shares only when profiling)
+        report = PROFILER.log(self.summary_writer, self.steps_done)
+
+        with PROFILER.phase("validation"):
+            val_wins, val_reward, val_loss = self.validate(environment)
+        self.last_validation = (val_wins, val_reward, val_loss)
+
+        current_datetime = datetime.datetime.now()
+        formatted_datetime = current_datetime.strftime("%Y-%m-%d %H:%M:%S")
+        wins_str = f"Avg Wins: {custom_round(val_wins, 3)}"
+        reward_str = f"Avg reward: {custom_round(val_reward, 3)}"
+        loss_str = f"Avg loss: {custom_round(val_loss, 3) if val_loss is not None else 'n/a'}"
+        step_str = f"Step: {self.steps_done}"
+        eps_str = f"Eps threshold: {self.eps_threshold:.2%}"
+
+        display_str = f"{formatted_datetime}, {wins_str}, {reward_str}, {loss_str}, {step_str}, {eps_str}"
+        print(display_str.ljust(self.LJUST_LENGTH), end="")
+        if PROFILER.enabled:
+            print("\n" + PROFILER.format_report(report), end="")
+
+        if val_reward > self.best_validation_score:
+            self.best_validation_score = val_reward
+            save_name = f"{self.checkpoint_save_name}_{self.LR}_{self.EPS_DECAY}"
+            self.save_model(os.path.join(self.OUTPUT_PATH, save_name))
+            print(f"\nNew best model found, saving to {save_name}", end="")
+        print()
         
-        avg_wins = total_wins / self.VALIDATION_GAMES
-        avg_reward = total_reward / self.VALIDATION_GAMES
-        avg_loss = total_loss / validation_steps
+        # Early Stopping
+        if self.best_score is None:
+            self.best_score = val_reward
+        elif val_reward > self.best_score:  # Maximize reward
+            self.best_score = val_reward
+            self.counter = 0
+        else:
+            self.counter += 1
+            if self.counter >= self.PATIENCE:
+                print(f"Early stopping triggered at step {self.steps_done}, no improvements after {self.PATIENCE}")
+                self.stop = True
+                return True
+        return False
+
+    # runs a few games with epsilon set to zero (no random moves)
+    # All the games are played at once, on the same deals every time: the first VALIDATION_GAMES deals of the
+    #   environment's deal bank, or else seeded deals with the trump suit of the environment
+    def validate(self, environment):
+        print("Validating".ljust(self.LJUST_LENGTH), end="\r")
+        with torch.inference_mode():
+            vec_environment = VecTennisEnv(environment.leader_q_network, environment.dealer_q_network, self.VALIDATION_GAMES,
+                                           rewarded_player=environment.rewarded_player, seed=SEED)
+            if environment.deal_bank is not None:
+                states = vec_environment.reset(*environment.deal_bank.batch(0, self.VALIDATION_GAMES))
+            else:
+                trump = torch.full((self.VALIDATION_GAMES,), environment.trump_suit == "S")
+                states = vec_environment.reset(trump=trump)
+            done = False
+            while not done:
+                actions = self.choose_actions(states, vec_environment.legal_mask())
+                states, rewards, done, exit_cond = vec_environment.step(actions)
+
+        winners = vec_environment.winners()
+        avg_wins = winners.count(environment.rewarded_player) / self.VALIDATION_GAMES
+        avg_reward = rewards.mean().item()
         self.summary_writer.add_scalar("Val win rate", avg_wins, self.steps_done)
         self.summary_writer.add_scalar("Val reward", avg_reward, self.steps_done)
         self.summary_writer.add_scalar("Epsilon threshold", self.eps_threshold, self.steps_done)
-        self.summary_writer.add_scalar("Loss", avg_loss, self.steps_done)
-        return avg_wins, avg_reward, avg_loss
+        return avg_wins, avg_reward, self.validation_loss
+
+    # Whether the transitions of the current game are held out of the replay memory to estimate the loss
+    # Whole games are held out, so no held-out transition has a neighbour from the same game in training
+    def holding_out(self):
+        return len(self.held_out) < self.LOSS_SNAPSHOT_SIZE and self.games_done % self.HOLD_OUT_FREQUENCY == 0
+
+    # estimates the loss on the held-out transitions, once there are enough of them
+    def estimate_loss(self):
+        if len(self.held_out) < self.LOSS_SNAPSHOT_SIZE:
+            return None
+
+        with torch.inference_mode():
+            state_action_values, expected_state_action_values = self.get_td_values(self.held_out.snapshot(self.LOSS_SNAPSHOT_SIZE))
+            loss = torch.nn.functional.smooth_l1_loss(state_action_values, expected_state_action_values.unsqueeze(1)).item()
+        self.validation_loss = loss
+        self.summary_writer.add_scalar("Loss", loss, self.steps_done)
+        return loss
+
+    # Computes the Q-values of a batch and the values expected from the rewards and the target network
+    def get_td_values(self, batch):
+        # Compute the Q-values for the current states and actions
+        state_action_values = self.policy_net(batch.state).gather(1, batch.action)
+
+        # Compute the maximum Q-value for the next states (used in Q-learning), which is zero for final states
+        with torch.no_grad():
+            next_state_values = self.target_net(batch.next_state).max(1)[0]
+        next_state_values = next_state_values.masked_fill(batch.done, 0)
+
+        # Compute the expected Q-values based on the rewards and future Q-values
+        expected_state_action_values = (next_state_values * self.GAMMA) + batch.reward
+        return state_action_values, expected_state_action_values
         
     def optimize_model(self, optimize=True):
         """
@@ -222,28 +443,17 @@ class DQN():
             return
 
         # Sample a batch of transitions from the memory
-        transitions = self.memory.sample(self.BATCH_SIZE)
-        batch = DQN.Transition(*zip(*transitions))
-
-        # Create a mask of non-final states (states that are not terminal)
-        non_final_mask = torch.tensor(tuple(map(lambda s: s is not None, batch.next_state)), device=device, dtype=torch.bool)
-        non_final_next_states = torch.cat([s for s in batch.next_state if s is not None])
-        state_batch = torch.cat(batch.state, dim=0).to(device)
-        action_batch = torch.cat(batch.action).to(device)
-        reward_batch = torch.tensor(batch.reward, device=device, dtype=torch.float32)
-
-        # Compute the Q-values for the current states and actions
-        state_action_values = self.policy_net(state_batch).gather(1, action_batch)
-
-        # Compute the maximum Q-value for the next states (used in Q-learning)
-        next_state_values = torch.zeros(self.BATCH_SIZE, device=device)
-        next_state_values[non_final_mask] = self.target_net(non_final_next_states).max(1)[0].detach()
-        
-        # Compute the expected Q-values based on the rewards and future Q-values
-        expected_state_action_values = (next_state_values * self.GAMMA) + reward_batch
+        self.memory.beta = min(1.0, self.PER_BETA_START + (1 - self.PER_BETA_START) * self.steps_done / self.PER_BETA_STEPS)
+        batch = self.memory.sample(self.BATCH_SIZE)
+        state_action_values, expected_state_action_values = self.get_td_values(batch)
 
         # Compute the Huber loss between the current and expected Q-values
-        loss = torch.nn.functional.smooth_l1_loss(state_action_values, expected_state_action_values.unsqueeze(1))
+        # Prioritized samples are weighted to correct for how often they are drawn
+        if batch.weight is None:
+            loss = torch.nn.functional.smooth_l1_loss(state_action_values, expected_state_action_values.unsqueeze(1))
+        else:
+            losses = torch.nn.functional.smooth_l1_loss(state_action_values, expected_state_action_values.unsqueeze(1), reduction="none")
+            loss = (losses.squeeze(1) * batch.weight).mean()
 
 
         # Add loss to running_losses and remove oldest if exceeds maxlen
@@ -257,6 +467,10 @@ class DQN():
                 param.grad.data.clamp_(self.GRAD_CLIP_MIN, self.GRAD_CLIP_MAX)
             self.optimizer.step()
 
+            # Sample the transitions the network predicts worst more often
+            td_errors = (state_action_values.detach().squeeze(1) - expected_state_action_values).abs()
+            self.memory.update_priorities(batch.index, td_errors)
+
         return loss
     
     def epsilon_greedy_policy(self, environment):
@@ -272,31 +486,156 @@ class DQN():
         """
         sample = random.random()  # Randomly sample a value between 0 and 1
         # Calculate the current epsilon threshold based on the number of steps taken
-        self.eps_threshold = self.EPS_END + (self.EPS_START - self.EPS_END) * math.exp(-1. * self.steps_done / self.EPS_DECAY)
+        self.eps_threshold = self.get_eps_threshold()
         self.steps_done += 1
         
-        legal_moves = environment.get_legal_moves() # Get the list of legal moves
-        
         # If the sampled value is greater than the threshold, select the best action based on the Q-values.
         if sample > self.eps_threshold:
             return self.choose_action(environment)
         else:
             # Select a random action from the set of legal moves
-            move_index = environment.action_space.index(random.choice(legal_moves))
+            move_index = random.choice(environment.legal_action_mask().nonzero().flatten().tolist())
             return torch.tensor([[move_index]], device=device, dtype=torch.long)
         
+    # the chance of a random move after the current number of steps
+    def get_eps_threshold(self):
+        return self.EPS_END + (self.EPS_START - self.EPS_END) * math.exp(-1. * self.steps_done / self.EPS_DECAY)
+
+    # Update the target network's weights in place, every TARGET_UPDATE_INTERVAL calls
+    def update_target_net(self):
+        self.target_update_steps += 1
+        if self.target_update_steps % self.TARGET_UPDATE_INTERVAL != 0:
+            return
+
+        with torch.no_grad():
+            if self.TARGET_UPDATE == "soft":
+                # target = target + TAU * (policy - target), for all tensors in one fused call
+                torch._foreach_lerp_(self.target_tensors, self.policy_tensors, self.TAU)
+            else:
+                for target_tensor, policy_tensor in zip(self.target_tensors, self.policy_tensors):
+                    target_tensor.copy_(policy_tensor)
+
     # return the best legal action from the current environment
     def choose_action(self, env):
-        state_tensor = env.get_current_state().unsqueeze(0).to(device) # Convert the state to a tensor and add a batch dimension
-        legal_moves = env.get_legal_moves() # Get the list of legal moves
+        with PROFILER.phase("state encoding"):
+            state_tensor = env.get_current_state().unsqueeze(0).to(device) # Convert the state to a tensor and add a batch dimension
+            legal_mask = env.legal_action_mask().to(device) # Get the mask of legal moves
         with torch.no_grad():
             q_values = self.policy_net(state_tensor)
             # Mask the Q-values of illegal moves
-            for i in range(len(env.action_space) ):
-                if i not in [env.action_space.index(card) for card in legal_moves]:
-                    q_values[0][i] = -float('inf')
-            return q_values.max(1)[1].view(1, 1)
-    
+            q_values = q_values.masked_fill(~legal_mask, -float('inf'))
+            best_q_value, best_action = q_values.max(1)
+            if env.q_record is not None: # the environment is logging Q-values
+                env.note_q_value(best_q_value.item())
+            return best_action.view(1, 1)
+
+    # return the best legal action for each state in a batch, as used by VecTennisEnv
+    def choose_actions(self, states, legal_mask):
+        with torch.no_grad():
+            q_values = self.policy_net(states.to(device))
+            q_values = q_values.masked_fill(~legal_mask.to(device), -float('inf'))
+            return q_values.max(1)[1].cpu()
+
+    # Asks for a checkpoint at the end of the current game, from a signal handler
+    def request_checkpoint(self, stop):
+        self.checkpoint_request = stop or bool(self.checkpoint_request)
+
+    # Saves a checkpoint every CHECKPOINT_FREQUENCY games or when a signal asked for one, and returns True if training should stop
+    def checkpoint_if_due(self):
+        request = self.checkpoint_request
+        periodic = self.CHECKPOINT_FREQUENCY > 0 and self.games_done % self.CHECKPOINT_FREQUENCY == 0
+        if request is None and not periodic:
+            return False
+        self.checkpoint_request = None
+        self.save_checkpoint()
+        if request:
+            print(f"\nStopping after saving a checkpoint to {self.get_checkpoint_path()}")
+        return bool(request)
+
+    def get_checkpoint_path(self):
+        if self.checkpoint_path:
+            return self.checkpoint_path
+        return os.path.join(self.OUTPUT_PATH, f"{self.checkpoint_save_name}_{self.LR}_{self.EPS_DECAY}_checkpoint.pt")
+
+    def training_state(self):
+        """
+        Take a snapshot of everything needed to resume training.
+
+        Every tensor is copied, so training can go on while the snapshot is written.
+
+        Returns:
+            dict: The networks, optimizer, replay memory, schedules, counters and random number generator states.
+        """
+        return clone_tensors({
+            "policy_net": self.policy_net.state_dict(),
+            "target_net": self.target_net.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "memory": self.memory.state_dict(),
+            "held_out": self.held_out.state_dict(),
+            "counters": {
+                "steps_done": self.steps_done,
+                "eps_threshold": self.eps_threshold,
+                "target_update_steps": self.target_update_steps,
+                "games_done": self.games_done,
+                "next_deals": list(self.next_deals) if self.next_deals is not None else None,
+                "best_validation_score": self.best_validation_score,
+                "validation_loss": self.validation_loss,
+                "last_validation": self.last_validation,
+                "counter": self.counter,
+                "best_score": self.best_score,
+            },
+            "running_averages": {
+                "rewards": self.running_rewards.values,
+                "wins": self.running_wins.values,
+                "losses": self.running_losses.values,
+            },
+            "rng": {
+                "random": random.getstate(),
+                "torch": torch.get_rng_state(),
+                "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            },
+        })
+
+    def save_checkpoint(self, path=None, block=False):
+        """
+        Save the training state from a background thread.
+
+        Args:
+            path (str): Where to save the checkpoint, get_checkpoint_path() if None.
+            block (bool): Wait until the checkpoint is written.
+        """
+        if self.checkpoint_writer is None:
+            self.checkpoint_writer = CheckpointWriter()
+        self.checkpoint_writer.submit(self.training_state(), path or self.get_checkpoint_path())
+        if block:
+            self.checkpoint_writer.flush()
+
+    # Waits for the checkpoints being written in the background
+    def flush_checkpoints(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
+
+    def load_checkpoint(self, path):
+        """Resume training from a checkpoint saved by save_checkpoint."""
+        checkpoint = read_checkpoint(path)
+        self.policy_net.load_state_dict(checkpoint["policy_net"])
+        self.target_net.load_state_dict(checkpoint["target_net"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        self.memory.load_state_dict(checkpoint["memory"])
+        self.held_out.load_state_dict(checkpoint["held_out"])
+
+        for name, value in checkpoint["counters"].items():
+            setattr(self, name, value)
+        self.running_rewards.values = list(checkpoint["running_averages"]["rewards"])
+        self.running_wins.values = list(checkpoint["running_averages"]["wins"])
+        self.running_losses.values = list(checkpoint["running_averages"]["losses"])
+
+        random.setstate(checkpoint["rng"]["random"])
+        torch.set_rng_state(checkpoint["rng"]["torch"])
+        if torch.cuda.is_available() and checkpoint["rng"]["cuda"] is not None:
+            torch.cuda.set_rng_state_all(checkpoint["rng"]["cuda"])
+        print(f"Resumed training from {path} after {self.games_done} games and {self.steps_done} steps")
+
     def load_model(self, policy_path=None, target_path=None):
         """Load a model from the given name."""
         if not policy_path:
@@ -327,16 +666,263 @@ class DQN():
         except Exception as e:
             print(f"Error saving model to {model_name}: {e}")
 
+# A Q-network that picks moves in other processes, without the optimizer, replay memory and logging of DQN
+class ActorPolicy():
+    def __init__(self, qNetwork, state_dict=None):
+        self.policy_net = qNetwork().to(device)
+        if state_dict is not None:
+            self.policy_net.load_state_dict(state_dict)
+
+    choose_action = DQN.choose_action
+    choose_actions = DQN.choose_actions
+
+    # like DQN.epsilon_greedy_policy, but the threshold is set by the learner
+    def epsilon_greedy_policy(self, environment, eps_threshold):
+        if random.random() > eps_threshold:
+            return self.choose_action(environment)
+        move_index = random.choice(environment.legal_action_mask().nonzero().flatten().tolist())
+        return torch.tensor([[move_index]], device=device, dtype=torch.long)
+
+# Plays self-play games in an actor process and sends each finished game to the learner
+def run_actor(env_class, rewarded_player, trainee_class, opponent_class, opponent_state_dict,
+              shared_net, weights_version, eps_threshold, transition_queue, stop_event, seed, actor_id=0,
+              deal_bank=None, first_deal=0, next_deal=0, recorder=None):
+    torch.set_num_threads(1)
+    random.seed(seed)
+    torch.manual_seed(seed)
+
+    trainee = ActorPolicy(trainee_class)
+    opponent = ActorPolicy(opponent_class, opponent_state_dict)
+    if rewarded_player == "leader":
+        environment = env_class(trainee, opponent, rewarded_player=rewarded_player, deal_bank=deal_bank, first_deal=first_deal, recorder=recorder)
+    else:
+        environment = env_class(opponent, trainee, rewarded_player=rewarded_player, deal_bank=deal_bank, first_deal=first_deal, recorder=recorder)
+    environment.next_deal = next_deal
+
+    version = None
+    while not stop_event.is_set():
+        # Reload the policy weights if the learner published new ones
+        if weights_version.value != version:
+            with weights_version.get_lock():
+                version = weights_version.value
+                trainee.policy_net.load_state_dict(shared_net.state_dict())
+
+        states, actions, next_states, rewards = [], [], [], []
+        state = environment.reset()
+        done = False
+        while not done:
+            action = trainee.epsilon_greedy_policy(environment, eps_threshold.value)
+            next_state, reward, done, exit_cond = environment.step(action.item())
+            states.append(state)
+            actions.append(action.item())
+            next_states.append(next_state)
+            rewards.append(reward)
+            state = next_state
+
+        # Games are sent as numpy arrays, which are pickled, so they outlive this process
+        game = (torch.stack(states).numpy(), torch.tensor(actions).numpy(), torch.stack(next_states).numpy(),
+                torch.tensor(rewards, dtype=torch.float32).numpy(), environment.winner == rewarded_player,
+                actor_id, environment.next_deal, recorder.last.copy() if recorder is not None else None)
+        while not stop_event.is_set():
+            try:
+                transition_queue.put(game, timeout=1)
+                break
+            except queue.Full:
+                continue
+
+# Moves items from a multiprocessing queue to a queue of this process until the stop event is set
+# An actor killed halfway through sending a game leaves a read that never returns, which only blocks this thread
+def relay_queue(source, destination, stop_event):
+    while not stop_event.is_set():
+        try:
+            item = source.get(timeout=1)
+        except queue.Empty:
+            continue
+        while not stop_event.is_set():
+            try:
+                destination.put(item, timeout=1)
+                break
+            except queue.Full:
+                continue
+
+# Raises if an actor process has exited, since actors only stop when the learner sets the stop event
+def check_actors(actors):
+    for actor_id, actor in enumerate(actors):
+        if not actor.is_alive():
+            raise RuntimeError(f"Actor {actor_id} exited with code {actor.exitcode}, see its traceback above")
+
+# Yields every item in the queue, waiting for the first one if block is True
+# While waiting, the actors are checked every timeout seconds, so the learner does not wait forever for dead actors
+def drain_queue(items, block, actors=(), timeout=1):
+    while True:
+        try:
+            yield items.get(block=block, timeout=timeout if block else None)
+        except queue.Empty:
+            if block:
+                check_actors(actors)
+                continue
+            return
+        block = False
+
+# A batch of transitions, each field stacked along the first dimension
+# index holds the sampled positions, and weight the importance-sampling weights (None for uniform sampling)
+# It is defined at module level so it can be pickled
+Batch = namedtuple('Batch', ('state', 'action', 'next_state', 'reward', 'done', 'index', 'weight'))
+
 # A class to store and manage transitions in reinforcement learning.
+# Transitions are kept in preallocated tensors used as a ring buffer, which are allocated on the first push
+#   once the size of the states is known. Final transitions store a zero next state and a done flag.
 class ReplayMemory(object):
+    Batch = Batch
+
     def __init__(self, capacity): # Initialize the ReplayMemory with a given capacity.
-        self.memory = deque([], maxlen=capacity)
-    def push(self, *args): # Store a new transition in the memory.
-        self.memory.append(DQN.Transition(*args))
-    def sample(self, batch_size): # Randomly sample a batch of transitions from the memory.
-        return random.sample(self.memory, batch_size)
+        self.capacity = capacity
+        self.position = 0 # where the next transition is written
+        self.size = 0
+        self.states = None
+
+    def _allocate(self, state_size):
+        self.states = torch.zeros(self.capacity, state_size, device=device)
+        self.next_states = torch.zeros(self.capacity, state_size, device=device)
+        self.actions = torch.zeros(self.capacity, 1, dtype=torch.long, device=device)
+        self.rewards = torch.zeros(self.capacity, device=device)
+        self.dones = torch.zeros(self.capacity, dtype=torch.bool, device=device)
+
+    def push(self, state, action, next_state, reward): # Store a new transition in the memory, next_state is None if it is final.
+        if self.states is None:
+            self._allocate(state.numel())
+        i = self.position
+        self.states[i] = state.view(-1)
+        self.actions[i] = action.view(-1)
+        if next_state is None:
+            self.next_states[i] = 0
+            self.dones[i] = True
+        else:
+            self.next_states[i] = next_state.view(-1)
+            self.dones[i] = False
+        self.rewards[i] = reward
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def push_batch(self, states, actions, next_states, rewards, dones): # Store many transitions at once.
+        if self.states is None:
+            self._allocate(states.shape[1])
+        indices = (self.position + torch.arange(len(states))) % self.capacity
+        indices = indices.to(device)
+        self.states[indices] = states.to(device)
+        self.actions[indices] = actions.view(-1, 1).to(device)
+        self.next_states[indices] = next_states.to(device).masked_fill(dones.view(-1, 1).to(device), 0)
+        self.rewards[indices] = rewards.to(device)
+        self.dones[indices] = dones.to(device)
+        self.position = (self.position + len(states)) % self.capacity
+        self.size = min(self.size + len(states), self.capacity)
+
+    def sample(self, batch_size): # Randomly sample a batch of transitions from the memory, with replacement.
+        indices = torch.randint(self.size, (batch_size,), device=device)
+        return self._gather(indices, None)
+
+    def update_priorities(self, indices, td_errors): # Uniform sampling has no priorities to update.
+        pass
+
+    def snapshot(self, size): # Copy a fixed random set of distinct transitions out of the memory.
+        indices = torch.randperm(self.size, device=device)[:size]
+        return self._gather(indices, None)
+
     def __len__(self): # Return the number of stored transitions in the memory.
-        return len(self.memory)
+        return self.size
+
+    def state_dict(self): # The stored transitions, which fill the start of the buffers until it wraps around.
+        state = {"position": self.position, "size": self.size}
+        if self.states is not None:
+            state.update(states=self.states[:self.size], actions=self.actions[:self.size], next_states=self.next_states[:self.size],
+                         rewards=self.rewards[:self.size], dones=self.dones[:self.size])
+        return state
+
+    def load_state_dict(self, state): # Restore the transitions saved by state_dict.
+        self.position = state["position"]
+        self.size = state["size"]
+        if "states" in state:
+            self._allocate(state["states"].shape[1])
+            self.states[:self.size] = state["states"].to(device)
+            self.actions[:self.size] = state["actions"].to(device)
+            self.next_states[:self.size] = state["next_states"].to(device)
+            self.rewards[:self.size] = state["rewards"].to(device)
+            self.dones[:self.size] = state["dones"].to(device)
+
+    def _gather(self, indices, weights):
+        return ReplayMemory.Batch(self.states[indices], self.actions[indices], self.next_states[indices],
+                                  self.rewards[indices], self.dones[indices], indices, weights)
+
+# A replay memory that samples transitions in proportion to their last TD error raised to the power alpha
+# The priorities are the leaves of a sum-tree stored in one array, where node i has children 2i+1 and 2i+2,
+#   so sampling and updating a whole batch takes one vectorized pass per level of the tree
+class PrioritizedReplayMemory(ReplayMemory):
+    def __init__(self, capacity, alpha=0.6, epsilon=1e-6):
+        super().__init__(capacity)
+        self.alpha = alpha
+        self.epsilon = epsilon # keeps every priority above zero
+        self.beta = 0.4 # the importance-sampling exponent, set by the learner
+        self.max_priority = 1.0 # new transitions get the highest priority seen so far
+
+        self.depth = max(1, math.ceil(math.log2(capacity)))
+        self.leaf_offset = 2 ** self.depth - 1
+        self.tree = torch.zeros(2 ** (self.depth + 1) - 1, dtype=torch.float64, device=device)
+
+    def push(self, state, action, next_state, reward):
+        index = self.position
+        super().push(state, action, next_state, reward)
+        self._set_priorities(torch.tensor([index], device=device), torch.tensor([self.max_priority], device=device))
+
+    def push_batch(self, states, actions, next_states, rewards, dones):
+        indices = ((self.position + torch.arange(len(states))) % self.capacity).to(device)
+        super().push_batch(states, actions, next_states, rewards, dones)
+        self._set_priorities(indices, torch.full((len(states),), self.max_priority, device=device))
+
+    def sample(self, batch_size): # Sample a batch in proportion to priority, one draw from each of batch_size equal segments.
+        total = self.tree[0]
+        targets = (torch.arange(batch_size, device=device) + torch.rand(batch_size, device=device)) * (total / batch_size)
+        targets = targets.clamp(max=total * (1 - 1e-12)).to(torch.float64)
+
+        # Walk down the tree, going right whenever the target is past the left child's sum
+        nodes = torch.zeros(batch_size, dtype=torch.long, device=device)
+        for _ in range(self.depth):
+            left = 2 * nodes + 1
+            left_sums = self.tree[left]
+            go_right = targets > left_sums
+            targets = targets - left_sums * go_right
+            nodes = left + go_right
+        indices = (nodes - self.leaf_offset).clamp(max=self.size - 1)
+
+        # Importance-sampling weights, normalized so the largest is 1
+        probabilities = self.tree[indices + self.leaf_offset] / total
+        weights = (self.size * probabilities) ** -self.beta
+        weights = (weights / weights.max()).to(torch.float32)
+        return self._gather(indices, weights)
+
+    def state_dict(self):
+        state = super().state_dict()
+        state.update(tree=self.tree, max_priority=self.max_priority, beta=self.beta)
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.tree.copy_(state["tree"])
+        self.max_priority = state["max_priority"]
+        self.beta = state["beta"]
+
+    def update_priorities(self, indices, td_errors):
+        priorities = td_errors.to(torch.float64) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max().item())
+        self._set_priorities(indices, priorities)
+
+    def _set_priorities(self, indices, priorities):
+        nodes = indices.to(device) + self.leaf_offset
+        self.tree[nodes] = priorities.to(device, torch.float64) ** self.alpha
+
+        # Recompute the sums of every ancestor, one level at a time
+        for _ in range(self.depth):
+            nodes = torch.unique((nodes - 1) // 2)
+            self.tree[nodes] = self.tree[2 * nodes + 1] + self.tree[2 * nodes + 2]
 
 def custom_round(number, digits=2):
     if not number or number == 0:
@@ -0,0 +1,129 @@
+# This script batches action requests from many concurrently running games into single forward passes.
+
+# Standard library imports
+import asyncio, queue, threading, time
+from collections import namedtuple
+from concurrent.futures import Future
+
+# Third-party imports
+import torch
+
+class InferenceServer:
+    """
+    InferenceServer picks moves for many games at once with one forward pass per batch.
+
+    Games running in other threads (or asyncio tasks) submit their state and legal action mask and wait
+    on a future. A worker thread collects requests until max_batch_size are waiting or max_wait seconds
+    have passed since the first one, runs the agent on the whole batch and resolves every future.
+    The server has a choose_action method, so it can stand in for a DQN as the leader or dealer of a TennisEnv.
+
+    Attributes:
+        agent (DQN): The agent whose choose_actions method is run on each batch.
+        max_batch_size (int): The largest number of requests in one forward pass.
+        max_wait (float): The longest time in seconds to wait for a batch to fill up.
+        batches (int): The number of forward passes run so far.
+        requests_served (int): The number of requests answered so far.
+    """
+
+    Request = namedtuple('Request', ('state', 'legal_mask', 'future'))
+
+    def __init__(self, agent, max_batch_size=256, max_wait=0.001):
+        self.agent = agent
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.requests_served = 0
+
+        self.requests = queue.Queue()
+        self.thread = None
+        self.stopped = False
+        self.lock = threading.Lock() # keeps submit from queueing a request behind the stop sentinel
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start the worker thread."""
+        if self.thread is None:
+            self.stopped = False
+            self.thread = threading.Thread(target=self._serve, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Answer the requests already submitted, then stop the worker thread."""
+        if self.thread is not None:
+            with self.lock:
+                self.stopped = True
+                self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, state, legal_mask):
+        """
+        Request an action for one state.
+
+        Args:
+            state (torch.Tensor): The state of the game.
+            legal_mask (torch.Tensor): The 52-element bool mask of legal actions.
+
+        Returns:
+            Future: A future that resolves to the chosen action index.
+
+        Raises:
+            RuntimeError: If the server has been stopped, since the request would never be answered.
+        """
+        future = Future()
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("The inference server has been stopped")
+            self.requests.put(InferenceServer.Request(state, legal_mask, future))
+        return future
+
+    # return the best legal action from the current environment, like DQN.choose_action
+    def choose_action(self, env):
+        action = self.submit(env.get_current_state(), env.legal_action_mask()).result()
+        return torch.tensor([[action]], dtype=torch.long)
+
+    # the same as choose_action, for games played as asyncio tasks
+    async def choose_action_async(self, env):
+        action = await asyncio.wrap_future(self.submit(env.get_current_state(), env.legal_action_mask()))
+        return torch.tensor([[action]], dtype=torch.long)
+
+    def _serve(self):
+        stopping = False
+        while not stopping:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            # Collect more requests until the batch is full or the deadline passes
+            batch = [request]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    request = self.requests.get(block=timeout > 0, timeout=max(timeout, 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            try:
+                states = torch.stack([request.state for request in batch])
+                legal_masks = torch.stack([request.legal_mask for request in batch])
+                actions = self.agent.choose_actions(states, legal_masks).tolist()
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            for request, action in zip(batch, actions):
+                request.future.set_result(action)
+            self.batches += 1
+            self.requests_served += len(batch)
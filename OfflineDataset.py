@@ -0,0 +1,161 @@
+# This script turns game logs (see GameLog.py) into datasets of transitions for offline training.
+# Games are replayed through TennisEnv in parallel worker processes, and the transitions of one seat are written
+#   to memory-mapped .npy shards, so datasets can be much larger than memory.
+# Rows are shuffled when a shard is written, so OfflineDataset can serve each minibatch as one contiguous,
+#   zero-copy slice of the shard.
+
+# Standard library imports
+import argparse, json, multiprocessing, os, random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+# Third-party imports
+import numpy
+import torch
+
+# Local imports
+from GameLog import open_game_log
+from GeneralDQN import ReplayMemory
+from TennisEnv import TennisEnv, STATE_SIZE
+
+TRANSITIONS_PER_GAME = 26 # each seat moves on every other ply
+FIELDS = {
+    "states": (numpy.float32, (STATE_SIZE,)),
+    "actions": (numpy.int64, (1,)),
+    "next_states": (numpy.float32, (STATE_SIZE,)), # zero for final transitions
+    "rewards": (numpy.float32, ()),
+    "dones": (numpy.bool_, ()),
+    "legal_masks": (numpy.bool_, (52,)),
+}
+
+def _build_shard(log_path, output_dir, seat, shard, start, stop, seed):
+    # Replay games start to stop of the log and write the seat's transitions to one shard, in a shuffled order
+    records = open_game_log(log_path)[start:stop]
+    count = len(records) * TRANSITIONS_PER_GAME
+    arrays = {name: numpy.lib.format.open_memmap(os.path.join(output_dir, f"shard_{shard:05d}_{name}.npy"), mode="w+",
+                                                 dtype=dtype, shape=(count,) + shape)
+              for name, (dtype, shape) in FIELDS.items()}
+    rows = numpy.random.default_rng(seed + shard).permutation(count).tolist()
+
+    environment = TennisEnv(None, None, rewarded_player="leader") # replay only, so nobody is asked for a move
+    seat_parity = 0 if seat == "leader" else 1
+    transition = 0
+    for record in records:
+        environment.reset(deal=(record["deal"].tolist(), bool(record["trump"])))
+        previous_row = None
+        for ply, card_index in enumerate(record["plays"].tolist()):
+            action = environment.card_action(card_index)
+            if ply % 2 == seat_parity:
+                state = environment.get_current_state()
+                if previous_row is not None:
+                    arrays["next_states"][previous_row] = state.numpy()
+                row = rows[transition]
+                transition += 1
+                arrays["states"][row] = state.numpy()
+                arrays["actions"][row] = action
+                arrays["legal_masks"][row] = environment.legal_action_mask().numpy()
+                previous_row = row
+            environment.step_helper(action)
+
+        # The seat's last move ends its game, the reward is zero before that
+        arrays["dones"][previous_row] = True
+        arrays["rewards"][previous_row] = environment.reward if seat == "leader" else -environment.reward
+
+    for array in arrays.values():
+        array.flush()
+    return shard, count
+
+def build_dataset(log_path, output_dir, seat="leader", workers=None, games_per_shard=10000, seed=0):
+    """
+    Replay a game log into a dataset of the transitions of one seat.
+
+    The transitions are the ones DQN.train stores: the state when the seat is to move, its action,
+    the state at its next move (after the opponent replied) and the reward at the end of the game.
+
+    Args:
+        log_path (str): The game log.
+        output_dir (str): The directory to write the shards and their index (dataset.json) to.
+        seat (str): "leader" or "dealer", the player whose transitions are kept.
+        workers (int): The number of worker processes, all cores if None.
+        games_per_shard (int): The number of games in each shard.
+        seed (int): The seed of the order of the rows within each shard.
+
+    Returns:
+        int: The number of transitions written.
+    """
+    assert seat in ["leader", "dealer"], "seat must be either 'leader' or 'dealer'"
+    os.makedirs(output_dir, exist_ok=True)
+    num_games = len(open_game_log(log_path))
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(_build_shard, log_path, output_dir, seat, shard, start, min(start + games_per_shard, num_games), seed)
+                   for shard, start in enumerate(range(0, num_games, games_per_shard))]
+        shards = [future.result() for future in futures]
+
+    with open(os.path.join(output_dir, "dataset.json"), "w") as file:
+        json.dump({"seat": seat, "log": log_path, "shards": [{"name": f"shard_{shard:05d}", "transitions": count} for shard, count in shards]}, file, indent=2)
+    return sum(count for shard, count in shards)
+
+# A ReplayMemory.Batch with the legal mask of each state, defined at module level so DataLoader workers can pickle it
+OfflineBatch = namedtuple('OfflineBatch', ReplayMemory.Batch._fields + ('legal_mask',))
+
+class OfflineDataset(torch.utils.data.IterableDataset):
+    """
+    OfflineDataset serves shuffled minibatches of transitions from the shards written by build_dataset.
+
+    Each minibatch is a contiguous slice of one shard, whose rows were shuffled when it was written,
+    and the slices are visited in a random order every epoch. The tensors of a batch share memory with the
+    memory-mapped shard, so nothing is copied until the batch is used. Batches have the fields of
+    ReplayMemory.Batch plus the legal masks, so DQN.get_td_values can take them directly.
+    Use it with a DataLoader(batch_size=None), whose workers split the slices between them.
+
+    Attributes:
+        seat (str): The player whose transitions the dataset holds.
+        shards (list): The memory-mapped arrays of each shard, by field name.
+        batch_size (int): The transitions in each minibatch (the last one of a shard may be smaller).
+    """
+    def __init__(self, directory, batch_size=200, shuffle=True, seed=0):
+        with open(os.path.join(directory, "dataset.json")) as file:
+            index = json.load(file)
+        self.seat = index["seat"]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        # Copy-on-write maps are writable, so torch can wrap them without copying or warning
+        self.shards = [{name: numpy.load(os.path.join(directory, f"{shard['name']}_{name}.npy"), mmap_mode="c") for name in FIELDS}
+                       for shard in index["shards"]]
+        self.slices = [(shard, start) for shard, arrays in enumerate(self.shards)
+                       for start in range(0, len(arrays["states"]), batch_size)]
+
+    def __len__(self):
+        return len(self.slices)
+
+    def __iter__(self):
+        slices = list(self.slices)
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(slices)
+        self.epoch += 1
+
+        worker = torch.utils.data.get_worker_info()
+        if worker is not None:
+            slices = slices[worker.id::worker.num_workers]
+
+        for shard, start in slices:
+            arrays = self.shards[shard]
+            batch = {name: torch.from_numpy(array[start:start + self.batch_size]) for name, array in arrays.items()}
+            yield OfflineBatch(batch["states"], batch["actions"], batch["next_states"], batch["rewards"], batch["dones"],
+                               None, None, batch["legal_masks"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", required=True, help="The game log to replay (see GameLog.py)")
+    parser.add_argument("--output", required=True, help="The directory to write the dataset to")
+    parser.add_argument("--seat", default="leader", help="\"leader\" or \"dealer\", whose transitions to keep")
+    parser.add_argument("--workers", type=int, default=None, help="The number of worker processes (default: all cores)")
+    parser.add_argument("--games_per_shard", type=int, default=10000, help="The number of games in each shard")
+    args = parser.parse_args()
+
+    transitions = build_dataset(args.log, args.output, args.seat, args.workers, args.games_per_shard)
+    print(f"Wrote {transitions} transitions to {args.output}")
@@ -29,13 +29,9 @@ def select_action(env):
     with torch.no_grad():
         q_values = policy_net(state_tensor)
         
-        # Get the list of legal moves
-        legal_moves = env.get_legal_moves()
-        
         # Mask the Q-values of illegal moves
-        for i in range(len(env.action_space)):
-            if i not in [env.action_space.index(card) for card in legal_moves]:
-                q_values[0][i] = -float('inf')
+        legal_mask = env.legal_action_mask().to(device)
+        q_values = q_values.masked_fill(~legal_mask, -float('inf'))
                 
         return q_values.max(1)[1].view(1, 1)
 
@@ -62,7 +58,10 @@ def human_play():
         rank = card_string[:-1].upper()
         suit = card_string[-1].upper()  # Convert to lowercase for consistency
         
-        return Card(rank, suit)
+        try:
+            return Card(rank, suit)
+        except ValueError:
+            return None
     
     while True:
         # Display the current state to the human player
@@ -0,0 +1,173 @@
+# This script measures where the time goes while training and evaluating.
+# PROFILER times named phases of the hot path, and counts events such as steps and games. It is disabled by default,
+#   in which case a phase is a shared do-nothing context manager and a count is one attribute check.
+# profile_run additionally records the whole run with cProfile and a stack sampler, for flamegraphs.
+
+# Standard library imports
+import cProfile, os, sys, threading, time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+_NULL_PHASE = nullcontext()
+
+class _Phase:
+    # Times one phase, excluding the time spent in phases nested inside it
+    __slots__ = ("timer", "name")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        timer = self.timer
+        now = time.perf_counter()
+        if timer.stack:
+            timer.times[timer.stack[-1]] += now - timer.mark
+        timer.stack.append(self.name)
+        timer.mark = now
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        timer = self.timer
+        now = time.perf_counter()
+        timer.times[timer.stack.pop()] += now - timer.mark
+        timer.calls[self.name] += 1
+        timer.mark = now
+
+class PhaseTimer:
+    """
+    PhaseTimer adds up the time spent in each phase and the number of events, over a window.
+
+    Use it as `with PROFILER.phase("simulation"): ...` and `PROFILER.count("steps")`. Nested phases are
+    timed exclusively, so the phases of a window add up to the time spent inside any phase.
+
+    Attributes:
+        enabled (bool): Whether phases are timed. Counts are always kept.
+        times (dict): The seconds spent in each phase in the current window.
+        calls (dict): The number of times each phase was entered in the current window.
+        counts (dict): The number of each event in the current window.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self.stack = []
+        self.mark = 0.0
+        self.reset_window()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        self.reset_window()
+
+    def phase(self, name):
+        """Return a context manager timing the named phase (doing nothing if disabled)."""
+        if not self.enabled:
+            return _NULL_PHASE
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = _Phase(self, name)
+        return phase
+
+    def count(self, name, amount=1):
+        """Count events, such as steps or games."""
+        self.counts[name] += amount
+
+    def reset_window(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+        self.window_start = time.perf_counter()
+
+    def window_report(self):
+        """
+        Summarize the current window and start a new one.
+
+        Returns:
+            dict: "elapsed" (seconds), "rates" (events per second), "shares" (fraction of the elapsed time in each phase)
+                  and "times" (seconds in each phase).
+        """
+        elapsed = max(time.perf_counter() - self.window_start, 1e-9)
+        report = {
+            "elapsed": elapsed,
+            "rates": {name: count / elapsed for name, count in self.counts.items()},
+            "shares": {name: seconds / elapsed for name, seconds in self.times.items()},
+            "times": dict(self.times),
+        }
+        self.reset_window()
+        return report
+
+    def log(self, summary_writer, step):
+        """Write the window report to a SummaryWriter and start a new window."""
+        report = self.window_report()
+        for name, rate in report["rates"].items():
+            summary_writer.add_scalar(f"Throughput/{name} per sec", rate, step)
+        for name, share in report["shares"].items():
+            summary_writer.add_scalar(f"Time share/{name}", share, step)
+        return report
+
+    def format_report(self, report):
+        """Return a window report as lines of text, the slowest phase first."""
+        lines = [f"{name}: {rate:.1f}/s" for name, rate in sorted(report["rates"].items())]
+        for name, seconds in sorted(report["times"].items(), key=lambda item: -item[1]):
+            lines.append(f"{name.ljust(24)} {seconds:9.3f}s {report['shares'][name]:7.1%}")
+        return "\n".join(lines)
+
+# The timer shared by everything in this process
+PROFILER = PhaseTimer()
+
+class StackSampler:
+    """
+    StackSampler samples the stack of a thread from a background thread and counts the collapsed stacks,
+    in the "frame;frame;frame count" format that flamegraph.pl and speedscope read.
+    """
+    def __init__(self, interval=0.001, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = defaultdict(int)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f"{stack} {count}\n")
+
+@contextmanager
+def profile_run(path_prefix):
+    """
+    Profile everything run inside the block and enable PROFILER.
+
+    Writes path_prefix.prof (cProfile, for pstats or snakeviz) and path_prefix.folded (sampled collapsed stacks, for flamegraphs).
+    """
+    directory = os.path.dirname(path_prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    PROFILER.enable()
+    sampler = StackSampler()
+    profiler = cProfile.Profile()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        profiler.dump_stats(path_prefix + ".prof")
+        sampler.write(path_prefix + ".folded")
+        print(f"\nWrote profiles to {path_prefix}.prof and {path_prefix}.folded")
@@ -0,0 +1,231 @@
+# This script runs hyperparameter sweeps, training several configurations at once in worker processes.
+# Configurations are compared at validation checkpoints and the worst ones are stopped early
+#   with asynchronous successive halving, so the cores go to the most promising configurations.
+
+# Standard library imports
+import csv, math, os, sys
+from multiprocessing.connection import wait
+
+# Third-party imports
+import torch
+
+# Local imports
+from GeneralDQN import DQN, VALIDATION_FREQUENCY
+from DealBank import DealBank
+from GameLog import GameRecorder
+from TennisEnv import TennisEnv
+from TennisQNet import TennisLeaderQNetwork, TennisDealerQNetwork
+
+def make_trainee(hyperparameters, options):
+    """
+    Create the leader, the dealer and their environment, and return the player being trained.
+
+    Args:
+        hyperparameters (dict): The hyperparameters of both DQNs.
+        options (dict): The "leader", "leader_target", "dealer" and "dealer_target" model paths (or None),
+                        the "trainee" ("leader" or "dealer") and optionally a "deal_bank" path and a "record_games" path
+                        to log the games to (with Q-values if "record_q_values" is set).
+
+    Returns:
+        tuple: The trainee DQN and the environment.
+    """
+    leader = DQN(TennisLeaderQNetwork, hyperparameters)
+    leader.load_model(options["leader"], options["leader_target"])
+    dealer = DQN(TennisDealerQNetwork, hyperparameters)
+    dealer.load_model(options["dealer"], options["dealer_target"])
+    # The first deals of a deal bank are kept for validation
+    deal_bank = DealBank(options["deal_bank"]) if options.get("deal_bank") else None
+    recorder = GameRecorder(options["record_games"], q_values=options.get("record_q_values", False)) if options.get("record_games") else None
+    environment = TennisEnv(leader, dealer, rewarded_player=options["trainee"], deal_bank=deal_bank, first_deal=leader.VALIDATION_GAMES,
+                            recorder=recorder)
+    return (leader if options["trainee"] == "leader" else dealer), environment
+
+def train_games(trainee, environment, games, options):
+    """Train the trainee for a number of games (-1 for no limit), in one process or with self-play actors."""
+    if options["actors"] > 0:
+        trainee.train_parallel(environment, save_name=options["save_name"], games=games, num_actors=options["actors"],
+                               sync_interval=options["sync_interval"], queue_depth=options["queue_depth"])
+    else:
+        trainee.train(environment, save_name=options["save_name"], games=games)
+
+# Trains one configuration in a worker process, a rung at a time
+# The scheduler sends the number of games to train until the next rung, or None to stop
+# After each rung the worker sends back (games trained, validation wins, validation reward, best reward, stopped early)
+def run_trial(hyperparameters, options, connection, threads, log_path):
+    torch.set_num_threads(threads)
+    sys.stdout = open(log_path, "w", buffering=1) # keep the progress output of the workers apart
+
+    trainee, environment = make_trainee(hyperparameters, options)
+    games_done = 0
+    games = connection.recv()
+    while games is not None:
+        assert games % trainee.VALIDATION_FREQUENCY == 0, "Rungs must fall on validation checkpoints"
+        train_games(trainee, environment, games, options)
+        games_done += games
+        val_wins, val_reward, val_loss = trainee.last_validation
+        connection.send((games_done, val_wins, val_reward, trainee.best_validation_score, trainee.stop))
+        games = connection.recv()
+    if environment.recorder is not None:
+        environment.recorder.close()
+
+class SuccessiveHalving():
+    """
+    Decides at each rung which trials keep training, in the style of ASHA.
+
+    Rungs are placed at min_games, min_games * reduction_factor, ... up to max_games, each rounded up to a multiple
+    of step so that trials are scored at a validation checkpoint. A trial reaching a rung keeps training only if
+    its score is in the top 1 / reduction_factor of all the scores recorded at that rung so far, so trials never wait
+    for each other.
+
+    Attributes:
+        rungs (list): The number of games at each rung, ending with max_games rounded up to a multiple of step.
+        scores (dict): The scores recorded at each rung.
+    """
+    def __init__(self, min_games, max_games, reduction_factor=3, step=1):
+        self.reduction_factor = reduction_factor
+        self.rungs = []
+        games = min_games
+        while games < max_games:
+            rung = step * math.ceil(games / step)
+            if not self.rungs or rung > self.rungs[-1]:
+                self.rungs.append(rung)
+            games *= reduction_factor
+        last_rung = step * math.ceil(max_games / step)
+        if not self.rungs or last_rung > self.rungs[-1]:
+            self.rungs.append(last_rung)
+        self.scores = {rung: [] for rung in self.rungs}
+
+    # return the rung after the given number of games, or None after the last one
+    def next_rung(self, games):
+        for rung in self.rungs:
+            if rung > games:
+                return rung
+        return None
+
+    # record a score at a rung and return True if the trial should keep training
+    def report(self, rung, score):
+        scores = self.scores[rung]
+        scores.append(score)
+        kept = max(1, len(scores) // self.reduction_factor)
+        return score >= sorted(scores, reverse=True)[kept - 1]
+
+# One configuration of the sweep and its latest results
+class Trial():
+    def __init__(self, hyperparameters):
+        self.hyperparameters = hyperparameters
+        self.games = 0
+        self.val_wins = None
+        self.val_reward = None
+        self.best_reward = None
+        self.status = "pending"
+        self.process = None
+        self.connection = None
+
+def run_sweep(configurations, options, workers=None, threads_per_worker=1, min_games=1000, max_games=27000,
+              reduction_factor=3, log_dir="logs"):
+    """
+    Train the configurations concurrently and stop the worst ones early.
+
+    Args:
+        configurations (list): The hyperparameter dicts to compare.
+        options (dict): The options shared by every trial, as used by make_trainee and train_games.
+        workers (int): The most trials training at once, all cores over threads_per_worker if None.
+        threads_per_worker (int): The torch intra-op threads of each trial.
+        min_games (int): The games before the first rung.
+        max_games (int): The games a trial trains for if it is never stopped.
+        Every rung, max_games included, is rounded up to a multiple of the validation frequency.
+        reduction_factor (int): The factor between rungs, of which only the top 1 / reduction_factor go on.
+        log_dir (str): Where each trial writes its progress output.
+
+    Returns:
+        list: The Trial of every configuration.
+    """
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    scheduler = SuccessiveHalving(min_games, max_games, reduction_factor, step=VALIDATION_FREQUENCY)
+    if scheduler.rungs[0] != min_games or scheduler.rungs[-1] != max_games:
+        print(f"Rungs rounded up to multiples of the validation frequency ({VALIDATION_FREQUENCY}): "
+              f"{', '.join(str(rung) for rung in scheduler.rungs)} games")
+    context = torch.multiprocessing.get_context("spawn")
+    os.makedirs(log_dir, exist_ok=True)
+
+    trials = [Trial(hyperparameters) for hyperparameters in configurations]
+    pending = list(trials)
+    running = {}
+    try:
+        while pending or running:
+            # Start trials while there are free workers
+            while pending and len(running) < workers:
+                trial = pending.pop(0)
+                log_path = os.path.join(log_dir, f"sweep_{trial.hyperparameters['LR']}_{trial.hyperparameters['EPS_DECAY']}.txt")
+                trial_options = dict(options)
+                if options.get("record_games"): # one game log for each trial
+                    trial_options["record_games"] = f"{options['record_games']}_{trial.hyperparameters['LR']}_{trial.hyperparameters['EPS_DECAY']}"
+                trial.connection, child_connection = context.Pipe()
+                # Not a daemon, so the trial can start self-play actors of its own
+                trial.process = context.Process(target=run_trial, args=(trial.hyperparameters, trial_options, child_connection,
+                                                                        threads_per_worker, log_path))
+                trial.process.start()
+                child_connection.close()
+                trial.connection.send(scheduler.next_rung(0))
+                trial.status = "running"
+                running[trial.connection] = trial
+
+            # Decide the fate of every trial that reached a rung
+            for connection in wait(list(running)):
+                trial = running[connection]
+                try:
+                    trial.games, trial.val_wins, trial.val_reward, trial.best_reward, stopped = connection.recv()
+                except EOFError:
+                    trial.status = "failed"
+                else:
+                    keep = scheduler.report(trial.games, trial.val_reward)
+                    if stopped:
+                        trial.status = "early stopped"
+                    elif scheduler.next_rung(trial.games) is None:
+                        trial.status = "completed"
+                    elif not keep:
+                        trial.status = f"halved at {trial.games}"
+                    else:
+                        connection.send(scheduler.next_rung(trial.games) - trial.games)
+                        print(f"LR {trial.hyperparameters['LR']}, EPS_DECAY {trial.hyperparameters['EPS_DECAY']}: "
+                              f"reward {trial.val_reward:.3f} at {trial.games} games, promoted")
+                        continue
+                    connection.send(None)
+                print(f"LR {trial.hyperparameters['LR']}, EPS_DECAY {trial.hyperparameters['EPS_DECAY']}: {trial.status}")
+                trial.process.join()
+                connection.close()
+                del running[connection]
+    finally:
+        for trial in running.values():
+            trial.process.terminate()
+    return trials
+
+def write_results(trials, path):
+    """
+    Write the results of a sweep as a CSV file, best first, and return them as a printable table.
+
+    Args:
+        trials (list): The trials returned by run_sweep.
+        path (str): The CSV file to write.
+
+    Returns:
+        str: The results table.
+    """
+    header = ["LR", "EPS_DECAY", "Games", "Val wins", "Val reward", "Best reward", "Status"]
+    ranked = sorted(trials, key=lambda trial: (trial.games, -math.inf if trial.val_reward is None else trial.val_reward), reverse=True)
+    rows = [[trial.hyperparameters["LR"], trial.hyperparameters["EPS_DECAY"], trial.games,
+             "" if trial.val_wins is None else f"{trial.val_wins:.3f}",
+             "" if trial.val_reward is None else f"{trial.val_reward:.3f}",
+             "" if trial.best_reward is None else f"{trial.best_reward:.3f}", trial.status] for trial in ranked]
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    return "\n".join("  ".join(str(value).ljust(width) for value, width in zip(row, widths)) for row in [header] + rows)
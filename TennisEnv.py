@@ -9,8 +9,16 @@ import torch
 import numpy
 
 # Local imports
-from card_game_utils.Deck import Deck, Card
+from card_game_utils.Deck import Deck, Card, CARDS
 from card_game_utils.TrickTaking import Trick
+from card_game_utils.Hand import Hand, SUITS, SUIT_MASKS
+from Profiler import PROFILER
+
+# The size of the state returned by get_current_state
+STATE_SIZE = 4*13*4 + 4*4 + 4*4 + 4 + 1 # hands, bids, trick, wins, trump suit
+
+# The column each mapped suit is written to in a card's part of the state
+SUIT_COLUMNS = {"C": 0, "D": 1, "H": 2, "S": 3}
 
 class TennisEnv:
     """
@@ -26,9 +34,13 @@ class TennisEnv:
         trick_number (int): The current trick number in the game.
         current_trick (Trick): The current trick being played.
         action_space (list): List of all possible cards that can be played.
+        deal_bank (DealBank): The deals to play, or None to shuffle the deck for every game.
+        first_deal (int): The index of the first deal to play from the deal bank, which play wraps back to at its end.
+        next_deal (int): The index of the deal the next reset plays, if there is a deal bank.
+        recorder (GameRecorder): Where every finished game is logged, or None.
     """
     
-    def __init__(self, leader, dealer, rewarded_player="leader"):
+    def __init__(self, leader, dealer, rewarded_player="leader", deal_bank=None, first_deal=0, recorder=None):
         """
         Initialize the Tennis environment.
         
@@ -36,6 +48,10 @@ class TennisEnv:
             trump_suit (str): The suit that is considered as trump for the current game.
             rewarded_player (str): Controls which player (leader or dealer) defines the reward for the environment.
                                    Must be either "leader" or "dealer".
+            deal_bank (DealBank, optional): Deals to play in order, each with its own trump suit.
+            first_deal (int): The index of the first deal to play from the deal bank. The deals before it are never
+                              played in order (they are held out for validation), even after the bank runs out.
+            recorder (GameRecorder, optional): Logs every finished game.
         
         Raises:
             AssertionError: If the rewarded_player is not "leader" or "dealer".
@@ -53,27 +69,75 @@ class TennisEnv:
         self.deck = Deck()
         self.current_trick = Trick(self.trump_suit)  # Non-trump round
         
-        # Define the action space based on a reference deck
-        reference_deck = Deck()
-        reference_deck.reset()
-        self.action_space = reference_deck.cards  # List of all possible cards that can be played
+        # Define the action space, the interned cards in the order of their action index
+        self.action_space = list(CARDS)  # List of all possible cards that can be played
 
         self.leader_q_network = leader
         self.dealer_q_network = dealer
 
+        self.deal_bank = deal_bank
+        self.first_deal = first_deal
+        self.next_deal = first_deal
+        self.recorder = recorder
+        self.deal = None # the card indices in the order they are dealt, kept for the recorder
+        self.q_record = None # the greedy Q-value at each ply, kept for the recorder
+
+        # The observation buffer, which is updated in place as cards move
+        self._state = torch.zeros(STATE_SIZE)
+        self._hand_rows = self._state[:208].view(4, 13, 4)
+        self._bid_rows = self._state[208:224].view(4, 4)
+        self._trick_rows = self._state[224:240].view(4, 4)
+        self._wins = self._state[240:244]
+        self._trump = self._state[244:]
+        self._state_mapping = None # the suit mapping the buffer is encoded with
+        
+        # The cached suit mapping, see get_suit_mapping
+        self._suit_mapping = None
+        self._inverse_suit_mapping = None
+        self._mapped_indices = None # the mapped action index of each card's action index
+        self._unmapped_indices = None # the inverse permutation of _mapped_indices
+        self._mapped_suit_indices = None # the mapped suit index of each suit index
+
     def set_seed(self, seed=None):
         random.seed(seed)
 
-    def reset(self):
+    def reset(self, deal_index=None, deal=None):
         """
         Reset the Tennis environment to its initial state.
         
-        This method initializes new players, resets the game state, shuffles the deck, 
-        and deals cards to the players' backhands. It then returns the current state of the game.
+        This method initializes new players, resets the game state, shuffles the deck (or takes the
+        next deal from the deal bank), and deals cards to the players' backhands. It then returns the current state of the game.
+        
+        Args:
+            deal_index (int, optional): The deal of the deal bank to play, instead of the next one.
+            deal (tuple, optional): The card indices in the order they are dealt and whether spades are trump,
+                                    to play instead of a shuffled or banked deal.
         
         Returns:
             torch.Tensor: The current state of the game after reset.
         """
+        # Reset and shuffle the deck of cards, or stack it with a deal from the bank, which also sets the trump suit
+        if deal is None and self.deal_bank is not None:
+            if deal_index is None:
+                if self.next_deal >= len(self.deal_bank): # start over, past the held-out deals
+                    self.next_deal = self.first_deal
+                deal_index = self.next_deal
+                self.next_deal += 1
+            deal = self.deal_bank[deal_index]
+        if deal is None:
+            self.deck.reset()
+            self.deck.shuffle()
+        else:
+            cards, spades_trump = deal
+            self.deck.cards = [CARDS[index] for index in reversed(cards)] # cards are drawn from the end
+            self.trump_suit = 'S' if spades_trump else None
+        self.current_trick = Trick(self.trump_suit)
+
+        if self.recorder is not None:
+            self.deal = [card.action_index for card in reversed(self.deck.cards)]
+            if self.recorder.q_values:
+                self.q_record = numpy.full(52, numpy.nan, dtype=numpy.float32)
+
         # Initialize new players for the game
         self.leader = TennisPlayer("leader", self.trump_suit)
         self.dealer = TennisPlayer("dealer", self.trump_suit)
@@ -85,16 +149,16 @@ class TennisEnv:
         self.trick_number = 0
         self.winner = None
         
-        # Reset and shuffle the deck of cards
-        self.deck.reset()
-        self.deck.shuffle()
-        
         # Deal 13 cards to each player's backhand and update the opponent's view of the hands
         for player in [self.leader, self.dealer]:
             player.backhand.add(self.deck.draw(13))
             for card in player.backhand.cards:
                 player.opponent_both_hands.play(card)
         
+        # Encode the new game into the observation buffer
+        self._suit_mapping = None
+        self._encode_state()
+        
         if self.rewarded_player == "dealer":
             self.step_helper(self.leader_q_network.choose_action(self))
         
@@ -103,14 +167,18 @@ class TennisEnv:
     
     def step(self, action):
 
-        next_state, reward, done, exit_cond = self.step_helper(action)
+        with PROFILER.phase("simulation"):
+            next_state, reward, done, exit_cond = self.step_helper(action)
         if self.done:
             return next_state, reward, done, exit_cond
 
-        if self.rewarded_player == "leader":
-            return self.step_helper(self.dealer_q_network.choose_action(self))
-        else:
-            return self.step_helper(self.leader_q_network.choose_action(self))
+        with PROFILER.phase("opponent inference"):
+            if self.rewarded_player == "leader":
+                action = self.dealer_q_network.choose_action(self)
+            else:
+                action = self.leader_q_network.choose_action(self)
+        with PROFILER.phase("simulation"):
+            return self.step_helper(action)
         
     def step_helper(self, action):
         """
@@ -135,26 +203,22 @@ class TennisEnv:
         played_card = self.action_space[action]
 
         # Check if the played card is a legal move
-        assert(played_card in self.get_legal_moves())
+        assert(self.legal_action_bits() >> action & 1)
         
         # Apply revsere mapping
-        inverse_suit_mapping = {v: k for k, v in self.get_suit_mapping().items()}
-        played_card = Card(played_card.rank, inverse_suit_mapping[played_card.suit])
+        self.get_suit_mapping()
+        played_card = self.action_space[self._unmapped_indices[action]]
 
         self.game_record.append(played_card)
         
-        # Sort all the cards in the players' hands
-        self.leader.backhand.sort_by_rank()
-        self.dealer.backhand.sort_by_rank()
-        self.leader.forehand.sort_by_rank()
-        self.dealer.forehand.sort_by_rank()
-        
         if self.leader.backhand_bid["card"] == None: # Leader forehand bid
-            self.leader.backhand_bid["card"] = self.leader.backhand.play(played_card)
-            self.leader.backhand_bid["value"] = self.leader.backhand_bid["card"].get_bid_value()
+            self.leader.backhand_bid["card"] = self._play_from_hand(1, self.leader.backhand, played_card)
+            self._encode_card(self._bid_rows[1], played_card)
+            self.leader.backhand_bid["value"] = played_card.bid_value
         elif self.dealer.backhand_bid["card"] == None: # Dealer forehand bid
-            self.dealer.backhand_bid["card"] = self.dealer.backhand.play(played_card)
-            self.dealer.backhand_bid["value"] = self.dealer.backhand_bid["card"].get_bid_value()
+            self.dealer.backhand_bid["card"] = self._play_from_hand(3, self.dealer.backhand, played_card)
+            self._encode_card(self._bid_rows[3], played_card)
+            self.dealer.backhand_bid["value"] = played_card.bid_value
               
             # Revealed the backhand bids
             self.leader.opponent_both_hands.play(self.dealer.backhand_bid["card"])
@@ -164,16 +228,21 @@ class TennisEnv:
                 
             # Deal 13 cards to each player's forehand
             for player in [self.leader, self.dealer]:
-                player.forehand = Deck()
+                player.forehand = Hand()
                 player.forehand.add(self.deck.draw(13))
                 for card in player.forehand.cards:
                     player.opponent_both_hands.play(card)
+            self._suit_mapping = None
+            self._encode_hand(0)
+            self._encode_hand(2)
         elif self.leader.forehand_bid["card"] == None: # Leader backhand bid
-            self.leader.forehand_bid["card"] = self.leader.forehand.play(played_card)
-            self.leader.forehand_bid["value"] = self.leader.forehand_bid["card"].get_bid_value()
+            self.leader.forehand_bid["card"] = self._play_from_hand(0, self.leader.forehand, played_card)
+            self._encode_card(self._bid_rows[0], played_card)
+            self.leader.forehand_bid["value"] = played_card.bid_value
         elif self.dealer.forehand_bid["card"] == None: # Dealer backhand bid
-            self.dealer.forehand_bid["card"] = self.dealer.forehand.play(played_card)
-            self.dealer.forehand_bid["value"] = self.dealer.forehand_bid["card"].get_bid_value()
+            self.dealer.forehand_bid["card"] = self._play_from_hand(2, self.dealer.forehand, played_card)
+            self._encode_card(self._bid_rows[2], played_card)
+            self.dealer.forehand_bid["value"] = played_card.bid_value
             
             # Revealed the forehand bids
             self.leader.opponent_both_hands.play(self.dealer.forehand_bid["card"])
@@ -183,25 +252,28 @@ class TennisEnv:
         else:
             # First card
             if len(self.current_trick) == 0:
-                self.leader.forehand.play(played_card)
+                self._play_from_hand(0, self.leader.forehand, played_card)
                 self.dealer.opponent_both_hands.play(played_card)
                 self.current_trick.add_card(played_card)
+                self._encode_card(self._trick_rows[0], played_card)
             
             # Second card
             elif len(self.current_trick) == 1:
-                self.dealer.forehand.play(played_card)
+                self._play_from_hand(2, self.dealer.forehand, played_card)
                 self.leader.opponent_both_hands.play(played_card)
                 self.current_trick.add_card(played_card)
+                self._encode_card(self._trick_rows[1], played_card)
             
             # Third card
             elif len(self.current_trick) == 2:
-                self.leader.backhand.play(played_card)
+                self._play_from_hand(1, self.leader.backhand, played_card)
                 self.dealer.opponent_both_hands.play(played_card)
                 self.current_trick.add_card(played_card)
+                self._encode_card(self._trick_rows[2], played_card)
             
             # Fourth card
             elif len(self.current_trick) == 3:
-                self.dealer.backhand.play(played_card)
+                self._play_from_hand(3, self.dealer.backhand, played_card)
                 self.current_trick.add_card(played_card)
                 self.leader.opponent_both_hands.play(played_card)
                 
@@ -219,12 +291,17 @@ class TennisEnv:
                     self.dealer.backhand_wins += 1
                     self.leader.opponent_backhand_wins += 1
                 
+                self._encode_wins()
+                
                 # Reset the trick
                 self.current_trick = Trick(self.trump_suit)
+                self._trick_rows.zero_()
                 
                 # Check if the game is over
                 if len(self.leader.forehand) == 0:
                     self.done = True
+                    if self.recorder is not None:
+                        self.recorder.record(self)
 
 
 
@@ -264,6 +341,10 @@ class TennisEnv:
                 else:
                     self.winner = "draw"
         
+        # Moving the leader's cards can change the suit mapping, which changes every encoded card
+        if self.get_suit_mapping() != self._state_mapping:
+            self._encode_state()
+        
         return self.get_current_state(), self.reward, self.done, {}
     
     def render(self):
@@ -322,89 +403,112 @@ class TennisEnv:
         return [seed_value]
 
     def get_suit_mapping(self):
-        ranks = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
-        suits = ['S', 'D', 'H', 'C']
-        unmapped_suits = ['S', 'D', 'H', 'C']
-        suit_mapping = {}
-        if self.trump_suit == "S":
-            suit_mapping["S"] = unmapped_suits.pop(0)
+        """
+        Return the suit isomorphism used for states and actions.
+        
+        Suits are renamed in the order the leader's lowest cards reveal them, spades stay spades
+        when they are trump, and suits the leader does not hold are renamed last. The mapping only
+        depends on the leader's cards, so it is cached with its inverse and a card index permutation,
+        and only recomputed after the leader's hands change.
         
+        Returns:
+            dict: The mapped suit of each suit.
+        """
+        if self._suit_mapping is None:
+            self._update_suit_mapping()
+        return self._suit_mapping
+    
+    def _update_suit_mapping(self):
+        suits = ['S', 'D', 'H', 'C']
         hands = self.leader.forehand + self.leader.backhand
-
-        # create mapping based on the cards in the rewarded players hands
-        for rank in ranks:
-            for suit in suits:
-                if suit in suit_mapping:
-                    continue
-                if Card(rank, suit) in hands:
-                    suit_mapping[suit] = unmapped_suits.pop(0)
-
-        # if the map is not complete, finish it randomly
-        for suit in suits:
-            if suit not in suit_mapping:
-                suit_mapping[suit] = unmapped_suits.pop(0)
-
-        return suit_mapping
-
-
-    def get_current_state(self):  
-        suit_mapping = self.get_suit_mapping()
-
-        def get_card_tensor(card):
-            if not card:
-                return torch.zeros(4)  
-            suit_vector = torch.zeros(4)
-            suit_mapping2 = {"C": 0, "D": 1, "H": 2, "S": 3}
-            suit_vector[suit_mapping2[suit_mapping[card.suit]]] = card.numeric_rank() / 14
-            
-            return suit_vector
-
-        # Initialize an empty list to store all tensors
-        state_tensors = []
-
+        
+        # order the suits by the lowest rank the leader holds in them
+        def priority(suit):
+            if suit == "S" and self.trump_suit == "S":
+                return (-1, 0)
+            ranks = hands.suit_bits(suit)
+            lowest_rank = (ranks & -ranks).bit_length() - 1 if ranks else 13
+            return (lowest_rank, suits.index(suit))
+        ordered_suits = sorted(suits, key=priority)
+        
+        self._suit_mapping = dict(zip(ordered_suits, suits))
+        self._inverse_suit_mapping = dict(zip(suits, ordered_suits))
+        
+        # action indices are suit-major, so mapping a card only moves it to another block of 13
+        self._mapped_indices = [0] * 52
+        self._unmapped_indices = [0] * 52
+        self._mapped_suit_indices = [SUITS.index(self._suit_mapping[suit]) for suit in SUITS]
+        for suit_index, suit in enumerate(SUITS):
+            mapped_offset = 13 * SUITS.index(self._suit_mapping[suit])
+            for rank_index in range(13):
+                index = 13 * suit_index + rank_index
+                self._mapped_indices[index] = mapped_offset + rank_index
+                self._unmapped_indices[mapped_offset + rank_index] = index
+    
+    def get_current_state(self):
+        """
+        Return the current state of the game from the observation buffer.
+        
+        The buffer is kept up to date by reset and step_helper, so this is a single copy.
+        
+        Returns:
+            torch.Tensor: A copy of the current state.
+        """
+        return self._state.clone()
+    
+    def _encode_state(self):
+        """Encode the whole game into the observation buffer using the current suit mapping."""
+        self._state_mapping = self.get_suit_mapping()
+        
         # Process hands
-        for hand in [self.leader.forehand, self.leader.backhand, self.dealer.forehand, self.dealer.backhand]:
-            tensor = torch.zeros(13, 4)  # Create a 13x5 tensor filled with zeros
-            for idx, card in enumerate(hand.cards):
-                tensor[idx] = get_card_tensor(card).clone().detach()
-            state_tensors.append(tensor)
-
+        for index in range(4):
+            self._encode_hand(index)
+        
         # Process bids
-        for bid in [
-           self.leader.forehand_bid,
-           self.leader.backhand_bid,
-           self.dealer.forehand_bid,
-           self.dealer.backhand_bid
-        ]:
-            value = bid.get("value", 0)
-            if value == None:
-                value = 0 # This value is equal to an actual bid of zero
-            else:
-                # Normalize the bid
-                value = value / 12
-            card_tensor = get_card_tensor(bid.get("card"))
-            state_tensors.append(card_tensor)
-
+        bids = [self.leader.forehand_bid, self.leader.backhand_bid, self.dealer.forehand_bid, self.dealer.backhand_bid]
+        for row, bid in zip(self._bid_rows, bids):
+            self._encode_card(row, bid.get("card"))
+        
         # Process current trick
-        trick_list = [get_card_tensor(card) for card in self.current_trick.cards]
-        while len(trick_list) < 4:
-            trick_list.append(torch.zeros(4))
-        state_tensors.extend(trick_list)
+        for slot, row in enumerate(self._trick_rows):
+            self._encode_card(row, self.current_trick.cards[slot] if slot < len(self.current_trick) else None)
         
         # Process wins
-        wins_info = torch.tensor([self.leader.forehand_wins / 12, self.leader.backhand_wins / 12, self.dealer.forehand_wins / 12, self.dealer.backhand_wins / 12])
-        state_tensors.append(wins_info)
-
+        self._encode_wins()
+        
         # Trump suit
-        trump_vector = torch.zeros(1)
-        if self.trump_suit == 'S':
-            trump_vector [0] = 1
-        state_tensors.append(trump_vector)
-
-        # Flatten and concatenate all tensors to form the final state tensor
-        state_tensor = torch.cat([tensor.flatten() for tensor in state_tensors])
-
-        return state_tensor
+        self._trump[0] = 1 if self.trump_suit == 'S' else 0
+    
+    def _hands(self):
+        # The hands in the order they appear in the state
+        return [self.leader.forehand, self.leader.backhand, self.dealer.forehand, self.dealer.backhand]
+    
+    def _encode_card(self, row, card):
+        # Write the given card, or nothing, into a 4-float row of the observation buffer
+        row.zero_()
+        if card:
+            row[SUIT_COLUMNS[self._state_mapping[card.suit]]] = card.rank_value / 14
+    
+    def _encode_hand(self, index):
+        # Write all the cards of one hand into its 13 rows of the observation buffer
+        rows = self._hand_rows[index]
+        rows.zero_()
+        for slot, card in enumerate(self._hands()[index].cards):
+            rows[slot, SUIT_COLUMNS[self._state_mapping[card.suit]]] = card.rank_value / 14
+    
+    def _encode_wins(self):
+        wins = [self.leader.forehand_wins, self.leader.backhand_wins, self.dealer.forehand_wins, self.dealer.backhand_wins]
+        self._wins.copy_(torch.tensor(wins) / 12)
+    
+    def _play_from_hand(self, index, hand, card):
+        # Play the card from the hand, and shift the later cards up one row in the observation buffer
+        if index < 2: # the suit mapping depends on the leader's cards
+            self._suit_mapping = None
+        slot = hand.cards.index(card)
+        rows = self._hand_rows[index]
+        rows[slot:-1] = rows[slot + 1:].clone()
+        rows[-1] = 0
+        return hand.play(card)
     
     def get_legal_moves(self):
         """
@@ -414,40 +518,77 @@ class TennisEnv:
         or bid by the current player. It considers the game phase (bidding or playing) and the current trick.
         
         Returns:
-            list: A list of legal moves available to the current player.
+            Deck: The legal moves available to the current player, as suit-mapped cards of the action space.
+        """
+        legal_bits = self.legal_action_bits()
+        mapped_moves = Deck()
+        mapped_moves.add([card for index, card in enumerate(self.action_space) if legal_bits >> index & 1])
+        return mapped_moves
+    
+    def legal_action_bits(self):
+        """
+        Determine the legal actions of the current player as a bitmask.
+        
+        Returns:
+            int: A 52-bit integer with bit i set when action i (in the suit-mapped action space) is legal.
+        """
+        hand = self._current_hand()
+        legal_bits = hand.bits
+        
+        # After the first card of a trick, players must follow suit if they can
+        if len(self.current_trick) > 0:
+            follow_bits = legal_bits & SUIT_MASKS[self.current_trick.lead_suit]
+            if follow_bits:
+                legal_bits = follow_bits
+        
+        # apply mapping, which moves each suit's block of 13 bits
+        self.get_suit_mapping()
+        mapped_bits = 0
+        for suit_index, mapped_suit_index in enumerate(self._mapped_suit_indices):
+            mapped_bits |= (legal_bits >> (13 * suit_index) & 0x1FFF) << (13 * mapped_suit_index)
+        return mapped_bits
+    
+    def legal_action_mask(self):
+        """
+        Determine the legal actions of the current player as a mask over the action space.
+        
+        Returns:
+            torch.Tensor: A 52-element bool tensor, True for legal actions.
         """
-        # Check if the leader has made their forehand bid
+        legal_bytes = numpy.frombuffer(self.legal_action_bits().to_bytes(7, "little"), dtype=numpy.uint8)
+        return torch.from_numpy(numpy.unpackbits(legal_bytes, bitorder="little")[:52].astype(bool))
+
+    def card_action(self, card_index):
+        """
+        Find the action that plays a card, under the current suit mapping.
+
+        Args:
+            card_index (int): The card's index in the unmapped action space (its Card.action_index).
+
+        Returns:
+            int: The suit-mapped action index to pass to step_helper.
+        """
+        self.get_suit_mapping()
+        return self._mapped_indices[card_index]
+
+    def note_q_value(self, q_value):
+        """Keep the greedy Q-value of the move about to be made, if the recorder logs Q-values."""
+        if self.q_record is not None:
+            self.q_record[len(self.game_record)] = q_value
+
+    def _current_hand(self):
+        # The hand the next card is bid or played from
         if self.leader.backhand_bid["card"] == None:
-            legal_moves = self.leader.backhand
-        # Check if the dealer has made their forehand bid
+            return self.leader.backhand
         elif self.dealer.backhand_bid["card"] == None:
-            legal_moves = self.dealer.backhand
-        # Check if the leader has made their backhand bid
+            return self.dealer.backhand
         elif self.leader.forehand_bid["card"] == None:
-            legal_moves = self.leader.forehand
-        # Check if the dealer has made their backhand bid
+            return self.leader.forehand
         elif self.dealer.forehand_bid["card"] == None:
-            legal_moves = self.dealer.forehand
-        else:
-            # Determine legal moves based on the number of cards played in the current trick
-            if len(self.current_trick) == 0:
-                legal_moves = self.current_trick.get_legal_moves(self.leader.forehand)
-            elif len(self.current_trick) == 1:
-                legal_moves = self.current_trick.get_legal_moves(self.dealer.forehand)
-            elif len(self.current_trick) == 2:
-                legal_moves = self.current_trick.get_legal_moves(self.leader.backhand)
-            elif len(self.current_trick) == 3:
-                legal_moves = self.current_trick.get_legal_moves(self.dealer.backhand)
-
-        # apply mapping
-        mapped_moves = Deck()
-        suit_mapping = self.get_suit_mapping()
-        for card in legal_moves:
-            mapped_moves.add(Card(card.rank, suit_mapping[card.suit]))
-            
-        return mapped_moves
+            return self.dealer.forehand
         
-        return legal_moves
+        # Within a trick the order is leader forehand, dealer forehand, leader backhand, dealer backhand
+        return [self.leader.forehand, self.dealer.forehand, self.leader.backhand, self.dealer.backhand][len(self.current_trick)]
     
     # Plays a random moe
     #def random_step(self):
@@ -465,9 +606,9 @@ class TennisPlayer:
         
         self.role = role # 'leader' or 'dealer'
         
-        # One deck for each hand
-        self.forehand = Deck()
-        self.backhand = Deck()
+        # One bitboard for each hand, always listed highest rank first
+        self.forehand = Hand()
+        self.backhand = Hand()
         
         # One dict (keys = 'card', 'value') for each hand
         # The data types for 'card' and 'value' are Card and int respectively
@@ -480,8 +621,8 @@ class TennisPlayer:
         
         # Information about the opponent #
         
-        # One dict for the all the cards the opponent has
-        self.opponent_both_hands = Deck()
+        # One bitboard for the all the cards the opponent has
+        self.opponent_both_hands = Hand()
         self.opponent_both_hands.reset()
         
         # One dict (keys = 'card', 'value') for each hand
@@ -3,6 +3,30 @@
 import torch
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
+# Columns of the state (see TennisEnv.get_current_state)
+HAND_SIZE = 13 * 4 # the columns of one hand
+BIDS = 4 * HAND_SIZE # the first bid column: leader forehand, leader backhand, dealer forehand and dealer backhand bids follow
+STATE_SIZE = BIDS + 4*4 + 4*4 + 4 + 1 # bids, trick, wins, trump suit
+
+def hide_unanswered_bids(state, bids: int):
+    """
+    Zero each of the leader's bids that the dealer has not answered yet, in place and row by row.
+
+    Bids are revealed in pairs, but the leader bids first, so the dealer must not see the leader's bid
+    for a hand before it has bid that hand itself.
+
+    Args:
+        state (torch.Tensor): A state or a batch of states, which is changed.
+        bids (int): The column of the leader's forehand bid in the state.
+
+    Returns:
+        torch.Tensor: The state.
+    """
+    dealer_bids = state[..., bids + 8:bids + 16].unflatten(-1, (2, 4))
+    answered = (dealer_bids != 0).any(-1).repeat_interleave(4, dim=-1)
+    state[..., bids:bids + 8] *= answered
+    return state
+
 # A Deep Q-Network (DQN) model for the Tennis card game.
 class TennisLeaderQNetwork(torch.nn.Module):
     
@@ -17,17 +41,18 @@ class TennisLeaderQNetwork(torch.nn.Module):
         self.input_size += + 4 # wins
         self.input_size += + 1 # trump suit
 
+        # The columns of the state fc1 sees: everything but the dealer's hands
+        self.input_columns = list(range(0, 2 * HAND_SIZE)) + list(range(4 * HAND_SIZE, STATE_SIZE))
+        self.register_buffer("input_index", torch.tensor(self.input_columns), persistent=False)
+
         # Define the neural network architecture
         self.fc1 = torch.nn.Linear(self.input_size, 128)
         self.out = torch.nn.Linear(128, 52)  # 52 possible actions
 
-    # Compute the Q-values for the given state using the DQN.
+    # Compute the Q-values for the given state (or batch of states) using the DQN.
     def forward(self, state):
-        # Mask out the dealer's hand information
-        state = state.to(device)
-        start = 2 * 13 * 4
-        end = 4 * 13 * 4
-        state = torch.cat((state[..., :start], state[..., end:]), dim=-1)
+        # Mask out the dealer's hand information, with one gather that leaves the given state unchanged
+        state = state.to(device).index_select(-1, self.input_index)
 
         x = torch.nn.functional.relu(self.fc1(state))
         return self.out(x)
@@ -46,24 +71,21 @@ class TennisDealerQNetwork(torch.nn.Module):
         self.input_size += + 4 # wins
         self.input_size += + 1 # trump suit
 
+        # The columns of the state fc1 sees: everything but the leader's hands
+        self.input_columns = list(range(2 * HAND_SIZE, STATE_SIZE))
+        self.register_buffer("input_index", torch.tensor(self.input_columns), persistent=False)
+
         # Define the neural network architecture
         self.fc1 = torch.nn.Linear(self.input_size, 128)
         self.out = torch.nn.Linear(128, 52)  # 52 possible actions
 
-    # Compute the Q-values for the given state using the DQN.
+    # Compute the Q-values for the given state (or batch of states) using the DQN.
     def forward(self, state):
-        # Mask out the leader's hand information
-        state = state.to(device)
-        start = 2 * 13 * 4
-        state = state[..., start:]
-        
-        # Check dealer's backhand bid and conditionally mask leader's backhand bid
-        if torch.all(state[220:224] == 0):
-            state[212:214] = 0
-
-        # Check dealer's forehand bid and conditionally mask leader's forehand bid
-        if torch.all(state[216:220] == 0):
-            state[208:212] = 0
+        # Mask out the leader's hand information, with one gather that copies the state
+        state = state.to(device).index_select(-1, self.input_index)
 
+        # Mask each of the leader's bids until the dealer has bid the same hand, in every row of the copy
+        hide_unanswered_bids(state, BIDS - 2 * HAND_SIZE)
+        
         x = torch.nn.functional.relu(self.fc1(state))
         return self.out(x)
\ No newline at end of file
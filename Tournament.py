@@ -0,0 +1,275 @@
+# This script runs duplicate-deal tournaments between a leader model and a dealer model.
+# Every deal is played twice: once by the models and once by a common baseline pair holding the same cards.
+# Comparing the two tables on the same deal cancels out how lucky the deal was for either seat.
+
+# Standard library imports
+import math, multiprocessing, random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Third-party imports
+import torch
+
+# Local imports
+from GeneralDQN import ActorPolicy
+from InferencePolicy import InferencePolicy, is_exported_policy
+from InferenceServer import InferenceServer
+from TennisEnv import TennisEnv
+from VecTennisEnv import VecTennisEnv, NUM_CARDS
+from TennisQNet import TennisLeaderQNetwork, TennisDealerQNetwork
+from Profiler import PROFILER
+
+# A policy that picks uniformly random legal moves, used as the default baseline
+class RandomPolicy():
+    def __init__(self, seed=0):
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+
+    def choose_actions(self, states, legal_mask):
+        return torch.multinomial(legal_mask.float(), 1, generator=self.generator).view(-1)
+
+def make_deals(num_deals, seed=0):
+    """
+    Create a fixed set of deals.
+
+    Args:
+        num_deals (int): The number of deals.
+        seed (int): The seed the deals are shuffled with.
+
+    Returns:
+        tuple: The [num_deals, 52] card indices of each deal (split as in VecTennisEnv.DEAL_SLICES)
+               and the [num_deals] bool trump flags.
+    """
+    rng = random.Random(seed)
+    deals = []
+    for _ in range(num_deals):
+        deal = list(range(NUM_CARDS))
+        rng.shuffle(deal)
+        deals.append(deal)
+    trump = [rng.random() < 0.5 for _ in range(num_deals)]
+    return torch.tensor(deals), torch.tensor(trump)
+
+def play_deals(leader, dealer, deals, trump):
+    """
+    Play every deal once, all at the same time.
+
+    Returns:
+        tuple: The [N] leader and dealer bid errors.
+    """
+    environment = VecTennisEnv(leader, dealer, len(deals), rewarded_player="leader")
+    states = environment.reset(deals=deals, trump=trump)
+    done = False
+    while not done:
+        agent = leader if environment.current_player() == "leader" else dealer
+        with PROFILER.phase("inference"):
+            actions = agent.choose_actions(states, environment.legal_mask())
+        with PROFILER.phase("simulation"):
+            states, rewards, done, exit_cond = environment.step_helper(actions)
+    PROFILER.count("games", len(deals))
+    return environment.bid_errors()
+
+def play_deals_concurrently(leader, dealer, deals, trump, concurrent_games):
+    """
+    Play every deal once as its own TennisEnv game, concurrent_games at a time in threads.
+
+    Each seat's moves go through an InferenceServer, which answers all the games waiting on it with one forward pass.
+    This is how games that arrive one at a time, such as games against people, are served; play_deals is faster
+    when every deal is known up front. Random moves depend on how the requests were batched, so they are not reproducible.
+
+    Returns:
+        tuple: The [N] leader and dealer bid errors.
+    """
+    leader_errors = [0] * len(deals)
+    dealer_errors = [0] * len(deals)
+
+    # Each thread plays every concurrent_games-th deal on its own environment
+    def play(first):
+        environment = TennisEnv(None, None, rewarded_player="leader")
+        for i in range(first, len(deals), concurrent_games):
+            environment.reset(deal=(deals[i].tolist(), bool(trump[i])))
+            while not environment.done:
+                server = leader_server if len(environment.game_record) % 2 == 0 else dealer_server
+                environment.step_helper(server.choose_action(environment).item())
+            leader, dealer = environment.leader, environment.dealer
+            leader_errors[i] = abs(leader.forehand_bid["value"] - leader.forehand_wins) + abs(leader.backhand_bid["value"] - leader.backhand_wins)
+            dealer_errors[i] = abs(dealer.forehand_bid["value"] - dealer.forehand_wins) + abs(dealer.backhand_bid["value"] - dealer.backhand_wins)
+
+    with InferenceServer(leader) as leader_server, InferenceServer(dealer) as dealer_server:
+        with ThreadPoolExecutor(max_workers=concurrent_games) as executor:
+            for future in [executor.submit(play, first) for first in range(concurrent_games)]:
+                future.result()
+    PROFILER.count("games", len(deals))
+    return torch.tensor(leader_errors, dtype=torch.float32), torch.tensor(dealer_errors, dtype=torch.float32)
+
+# The agents of a worker process, loaded once by _init_worker, and how it plays its deals
+_agents = {}
+_options = {"concurrent_games": 1}
+
+def _load_agent(qNetwork, path, seed):
+    if path == "random":
+        return RandomPolicy(seed)
+    if path and is_exported_policy(path):
+        return InferencePolicy(path, threads=None) # the worker's threads are already set
+    torch.manual_seed(seed) # models without weights start from the same initialization in every worker
+    return ActorPolicy(qNetwork, torch.load(path, map_location="cpu") if path else None)
+
+def _init_worker(leader_path, dealer_path, baseline_leader_path, baseline_dealer_path, threads, concurrent_games=1):
+    torch.set_num_threads(threads)
+    _options["concurrent_games"] = concurrent_games
+    _agents["leader"] = _load_agent(TennisLeaderQNetwork, leader_path, 0)
+    _agents["dealer"] = _load_agent(TennisDealerQNetwork, dealer_path, 0)
+    _agents["baseline_leader"] = _load_agent(TennisLeaderQNetwork, baseline_leader_path, 1)
+    _agents["baseline_dealer"] = _load_agent(TennisDealerQNetwork, baseline_dealer_path, 2)
+
+def _play_shard(start, deals, trump):
+    # Random baselines are reseeded per shard, so results do not depend on which worker plays it
+    concurrent_games = _options["concurrent_games"]
+    with torch.inference_mode():
+        for agent in _agents.values():
+            if isinstance(agent, RandomPolicy):
+                agent.generator.manual_seed(start)
+        if concurrent_games > 1:
+            model_errors = play_deals_concurrently(_agents["leader"], _agents["dealer"], deals, trump, concurrent_games)
+            baseline_errors = play_deals_concurrently(_agents["baseline_leader"], _agents["baseline_dealer"], deals, trump, concurrent_games)
+        else:
+            model_errors = play_deals(_agents["leader"], _agents["dealer"], deals, trump)
+            baseline_errors = play_deals(_agents["baseline_leader"], _agents["baseline_dealer"], deals, trump)
+    return start, [errors.tolist() for errors in model_errors + baseline_errors]
+
+def run_tournament(leader_path=None, dealer_path=None, baseline_leader_path="random", baseline_dealer_path="random",
+                   num_deals=10000, seed=0, workers=None, shard_size=500, threads_per_worker=1, deal_bank=None,
+                   concurrent_games=1):
+    """
+    Play a duplicate tournament on a process pool.
+
+    Args:
+        leader_path (str): The leader policy network (.pt) or exported policy (see InferencePolicy.py),
+                           or None for an untrained network.
+        dealer_path (str): The dealer policy network (.pt) or exported policy, or None for an untrained network.
+        baseline_leader_path (str): The baseline leader (.pt), "random" for random legal moves, or None.
+        baseline_dealer_path (str): The baseline dealer (.pt), "random" for random legal moves, or None.
+        num_deals (int): The number of deals, each played at both tables.
+        seed (int): The seed of the deals, if there is no deal bank.
+        workers (int): The number of worker processes, all cores if None, or 0 to play in this process.
+        shard_size (int): The number of deals each task plays at once.
+        threads_per_worker (int): The torch intra-op threads of each worker.
+        deal_bank (DealBank): Play the first num_deals deals of this bank instead of seeded deals (optional).
+        concurrent_games (int): If above 1, each worker plays its deals as separate games in this many threads,
+                                with batched moves (see play_deals_concurrently), instead of all at once in a VecTennisEnv.
+
+    Returns:
+        dict: Lists of the leader and dealer bid errors at the model table and at the baseline table.
+    """
+    if deal_bank is not None:
+        deals, trump = deal_bank.batch(0, num_deals)
+    else:
+        deals, trump = make_deals(num_deals, seed)
+    initargs = (leader_path, dealer_path, baseline_leader_path, baseline_dealer_path, threads_per_worker, concurrent_games)
+    starts = range(0, num_deals, shard_size)
+    results = {}
+    if workers == 0:
+        # Play every shard in this process, where a profiler can see the games
+        _init_worker(*initargs)
+        for done_shards, start in enumerate(starts):
+            results[start] = _play_shard(start, deals[start:start + shard_size], trump[start:start + shard_size])[1]
+            print(f"Progress {(done_shards + 1)/len(starts):.1%}", end="\r")
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=initargs) as executor:
+            futures = [executor.submit(_play_shard, start, deals[start:start + shard_size], trump[start:start + shard_size])
+                       for start in starts]
+            for done_shards, future in enumerate(futures):
+                start, errors = future.result()
+                results[start] = errors
+                print(f"Progress {(done_shards + 1)/len(futures):.1%}", end="\r")
+    print()
+
+    keys = ["leader_errors", "dealer_errors", "baseline_leader_errors", "baseline_dealer_errors"]
+    return {key: [error for start in sorted(results) for error in results[start][i]] for i, key in enumerate(keys)}
+
+def compare_policies(reference_path, candidate_path, seat, opponent_path="random", deals=None, trump=None):
+    """
+    Check how closely a candidate policy, such as a quantized export, plays like a reference policy in one seat.
+
+    The greedy-action agreement is measured on the states the reference reaches playing the deals, and both
+    policies then play every deal against the same opponent to compare their win rates.
+
+    Args:
+        reference_path (str): The reference model (.pt) or exported policy.
+        candidate_path (str): The candidate model (.pt) or exported policy.
+        seat (str): "leader" or "dealer", the seat of both policies.
+        opponent_path (str): The other seat's model (.pt) or exported policy, or "random".
+        deals (torch.Tensor): The [N, 52] card indices of each deal (see make_deals).
+        trump (torch.Tensor): The [N] bool trump flags.
+
+    Returns:
+        dict: The fraction of the seat's moves on which the policies agree and the number of moves ("agreement", "moves"),
+              and (mean, half-width) pairs for the seat's win rate with each policy and the candidate's minus the reference's.
+    """
+    assert seat in ["leader", "dealer"], "seat must be either 'leader' or 'dealer'"
+    networks = {"leader": TennisLeaderQNetwork, "dealer": TennisDealerQNetwork}
+    reference = _load_agent(networks[seat], reference_path, 0)
+    candidate = _load_agent(networks[seat], candidate_path, 0)
+    opponent = _load_agent(networks["dealer" if seat == "leader" else "leader"], opponent_path, 1)
+
+    with torch.inference_mode():
+        # Greedy-action agreement along the reference's games
+        leader, dealer = (reference, opponent) if seat == "leader" else (opponent, reference)
+        if isinstance(opponent, RandomPolicy):
+            opponent.generator.manual_seed(0)
+        environment = VecTennisEnv(leader, dealer, len(deals), rewarded_player="leader")
+        states = environment.reset(deals=deals, trump=trump)
+        agreements = moves = 0
+        done = False
+        while not done:
+            player = environment.current_player()
+            legal_mask = environment.legal_mask()
+            actions = (leader if player == "leader" else dealer).choose_actions(states, legal_mask)
+            if player == seat:
+                agreements += (candidate.choose_actions(states, legal_mask) == actions).sum().item()
+                moves += len(actions)
+            states, rewards, done, exit_cond = environment.step_helper(actions)
+
+        # Win rates against the same opponent, which plays the same random moves at both tables if it is random
+        wins = {}
+        for name, agent in [("reference", reference), ("candidate", candidate)]:
+            if isinstance(opponent, RandomPolicy):
+                opponent.generator.manual_seed(0)
+            leader_errors, dealer_errors = play_deals(*((agent, opponent) if seat == "leader" else (opponent, agent)), deals, trump)
+            difference = (dealer_errors - leader_errors) if seat == "leader" else (leader_errors - dealer_errors)
+            wins[name] = (difference > 0).float().tolist()
+
+    return {
+        "agreement": agreements / moves,
+        "moves": moves,
+        "reference_win_rate": mean_confidence_interval(wins["reference"]),
+        "candidate_win_rate": mean_confidence_interval(wins["candidate"]),
+        "win_rate_difference": mean_confidence_interval([c - r for r, c in zip(wins["reference"], wins["candidate"])]),
+    }
+
+def mean_confidence_interval(values, z=1.96):
+    """Return the mean of the values and the half-width of its normal-approximation confidence interval."""
+    n = len(values)
+    mean = sum(values) / n
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1) if n > 1 else 0.0
+    return mean, z * math.sqrt(variance / n)
+
+def summarize(results):
+    """
+    Compute the tournament statistics with 95% confidence intervals.
+
+    The error difference is the dealer's bid error minus the leader's, so positive is good for the leader.
+    The duplicate difference subtracts the baseline table's error difference on the same deal.
+
+    Returns:
+        dict: (mean, half-width) pairs for the leader win rate, dealer win rate, draw rate,
+              error difference and duplicate error difference.
+    """
+    differences = [d - l for l, d in zip(results["leader_errors"], results["dealer_errors"])]
+    baseline_differences = [d - l for l, d in zip(results["baseline_leader_errors"], results["baseline_dealer_errors"])]
+    return {
+        "leader_win_rate": mean_confidence_interval([1.0 if difference > 0 else 0.0 for difference in differences]),
+        "dealer_win_rate": mean_confidence_interval([1.0 if difference < 0 else 0.0 for difference in differences]),
+        "draw_rate": mean_confidence_interval([1.0 if difference == 0 else 0.0 for difference in differences]),
+        "error_difference": mean_confidence_interval(differences),
+        "duplicate_error_difference": mean_confidence_interval([model - baseline for model, baseline in zip(differences, baseline_differences)]),
+    }
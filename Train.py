@@ -1,10 +1,8 @@
 import argparse
+from contextlib import nullcontext
 
-from GeneralDQN import DQN
-
-from TennisEnv import TennisEnv
-from TennisQNet import TennisLeaderQNetwork
-from TennisQNet import TennisDealerQNetwork
+from Sweep import make_trainee, train_games, run_sweep, write_results
+from Profiler import profile_run
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -14,40 +12,60 @@ if __name__ == "__main__":
     parser.add_argument("--dealer_target", default=None, help="The dealer target network(.pt) (optional)")
     parser.add_argument("--trainee", default="leader", help="\"dealer\" or \"leader\"")
     parser.add_argument("--save_name", default="best", help="Path to save checkpoints to")
+    parser.add_argument("--actors", type=int, default=0, help="Number of self-play actor processes (0 trains in a single process)")
+    parser.add_argument("--sync_interval", type=int, default=100, help="Optimization steps between actor weight updates")
+    parser.add_argument("--queue_depth", type=int, default=64, help="Maximum finished games waiting for the learner")
+    parser.add_argument("--prioritized_replay", action="store_true", help="Sample transitions in proportion to their TD error")
+    parser.add_argument("--target_update", default="soft", help="\"soft\" (blend) or \"hard\" (copy) target network updates")
+    parser.add_argument("--target_update_interval", type=int, default=1, help="Optimization steps between target network updates")
+    parser.add_argument("--learning_rates", type=float, nargs="+", default=[1e-3, 5e-4, 1e-4, 5e-5, 1e-5], help="The learning rates to sweep")
+    parser.add_argument("--epsilon_decays", type=float, nargs="+", default=[1e5, 5e5, 1e6, 5e6], help="The epsilon decays to sweep")
+    parser.add_argument("--max_games", type=int, default=None, help="Games to train each configuration for (default: no limit for one configuration, rung_games * reduction_factor^3 for a sweep)")
+    parser.add_argument("--rung_games", type=int, default=1000, help="Games before the first comparison of a sweep, rounded up to a multiple of the validation frequency")
+    parser.add_argument("--reduction_factor", type=int, default=3, help="Only the top 1/reduction_factor of a sweep's configurations go on at each rung")
+    parser.add_argument("--workers", type=int, default=None, help="Configurations trained at once (default: cores / threads_per_worker)")
+    parser.add_argument("--threads_per_worker", type=int, default=1, help="Torch threads for each configuration of a sweep")
+    parser.add_argument("--checkpoint_frequency", type=int, default=5000, help="Games between full training checkpoints (0 saves only on SIGINT/SIGTERM/SIGUSR1)")
+    parser.add_argument("--resume", default=None, help="A training checkpoint (.pt) to resume a single configuration from (optional)")
+    parser.add_argument("--deal_bank", default=None, help="A deal bank (.npy) to train and validate on, see DealBank.py (optional)")
+    parser.add_argument("--record_games", default=None, help="A game log to append every training game to, see GameLog.py (optional)")
+    parser.add_argument("--record_q_values", action="store_true", help="Also log the Q-value of each greedy move")
+    parser.add_argument("--profile", nargs="?", const="outputs/train", default=None,
+                        help="Time each phase of training and write a cProfile (.prof) and collapsed-stack (.folded) profile with this path prefix")
+    parser.add_argument("--results", default="outputs/sweep_results.csv", help="Path to write the sweep results table to")
     args = parser.parse_args()
 
     assert(args.trainee in ["leader", "dealer"])
+    if args.resume and len(args.learning_rates) * len(args.epsilon_decays) > 1:
+        parser.error("--resume needs a single learning rate and epsilon decay")
+    if args.profile and len(args.learning_rates) * len(args.epsilon_decays) > 1:
+        parser.error("--profile needs a single learning rate and epsilon decay")
 
+    options = {"leader": args.leader, "leader_target": args.leader_target, "dealer": args.dealer, "dealer_target": args.dealer_target,
+               "trainee": args.trainee, "save_name": args.save_name, "actors": args.actors,
+               "sync_interval": args.sync_interval, "queue_depth": args.queue_depth, "deal_bank": args.deal_bank,
+               "record_games": args.record_games, "record_q_values": args.record_q_values}
+    configurations = []
+    for lr in args.learning_rates:
+        for eps_decay in args.epsilon_decays:
+            configurations.append({"LR": lr, "EPS_DECAY": eps_decay, "PRIORITIZED_REPLAY": args.prioritized_replay,
+                                   "TARGET_UPDATE": args.target_update, "TARGET_UPDATE_INTERVAL": args.target_update_interval,
+                                   "CHECKPOINT_FREQUENCY": args.checkpoint_frequency})
 
-
-    learning_rates = [1e-3, 5e-4, 1e-4, 5e-5, 1e-5]
-    epsilon_decays = [1e5, 5e5, 1e6, 5e6]
-    for lr in learning_rates:
-        for eps_decay in epsilon_decays:
-            hyperparameters = {"LR": lr, "EPS_DECAY": eps_decay}
-
-            # Leader
-            leader = DQN(TennisLeaderQNetwork, hyperparameters)
-            leader.load_model(args.leader, args.leader_target)
-
-            # Dealer
-            dealer = DQN(TennisDealerQNetwork, hyperparameters)
-            dealer.load_model(args.dealer, args.dealer_target)
-
-            # Environment
-            environment = TennisEnv(leader, dealer, rewarded_player=args.trainee)
-
-            # Train just one player at a time
-            if args.trainee == "leader":
-                trainee_obj = leader
-            else:
-                trainee_obj = dealer
-
-            # Train the model
-            trainee_obj.train(environment, save_name=args.save_name)
-
-            # Validate
-            avg_reward = trainee_obj.validate(environment)
-
-            # Print results
-            print("Learning rate: {lr}, Epsilon decay: {eps_decay}, Average reward: {avg_reward}")
\ No newline at end of file
+    if len(configurations) == 1:
+        # Train a single configuration in this process
+        trainee_obj, environment = make_trainee(configurations[0], options)
+        if args.resume:
+            trainee_obj.load_checkpoint(args.resume)
+        with profile_run(args.profile) if args.profile else nullcontext():
+            train_games(trainee_obj, environment, args.max_games or -1, options)
+        if environment.recorder is not None:
+            environment.recorder.close()
+        val_wins, val_reward, val_loss = trainee_obj.validate(environment)
+        print(f"Learning rate: {configurations[0]['LR']}, Epsilon decay: {configurations[0]['EPS_DECAY']}, Average reward: {val_reward}")
+    else:
+        # Sweep the configurations concurrently, stopping the worst ones at each rung
+        max_games = args.max_games or args.rung_games * args.reduction_factor ** 3
+        trials = run_sweep(configurations, options, workers=args.workers, threads_per_worker=args.threads_per_worker,
+                           min_games=args.rung_games, max_games=max_games, reduction_factor=args.reduction_factor)
+        print(write_results(trials, args.results))
@@ -0,0 +1,319 @@
+# This is a vectorized implementation of the card game Tennis (https://etgdesign.com/games/tennis/).
+# It plays many games in lockstep so that both networks can pick moves for every game in one forward pass.
+
+# Third-party imports
+import torch
+
+# Local imports
+from TennisEnv import STATE_SIZE
+
+# Cards are identified by their action index: suit-major in the order C, S, H, D, then rank from 2 to A
+NUM_CARDS = 52
+NUM_PLIES = 4 + 48 # four bids, then twelve tricks of four cards
+
+# The hands in the order they appear in the state: leader forehand, leader backhand, dealer forehand, dealer backhand
+LEADER_FOREHAND, LEADER_BACKHAND, DEALER_FOREHAND, DEALER_BACKHAND = range(4)
+
+# The hand that bids on each of the first four plies, and the hand that plays each card of a trick
+BID_HANDS = [LEADER_BACKHAND, DEALER_BACKHAND, LEADER_FOREHAND, DEALER_FOREHAND]
+TRICK_HANDS = [LEADER_FOREHAND, DEALER_FOREHAND, LEADER_BACKHAND, DEALER_BACKHAND]
+
+# A deal is a permutation of the 52 card indices, split into the four hands in the order they are dealt
+DEAL_SLICES = {
+    LEADER_BACKHAND: slice(0, 13),
+    DEALER_BACKHAND: slice(13, 26),
+    LEADER_FOREHAND: slice(26, 39),
+    DEALER_FOREHAND: slice(39, 52),
+}
+
+_SPADES = 1
+_RANKS = torch.arange(NUM_CARDS) % 13
+_SUITS = torch.arange(NUM_CARDS) // 13
+
+# The value of a card in the state and as a bid, by rank index
+_STATE_VALUES = (torch.arange(13, dtype=torch.float32) + 2) / 14
+_BID_VALUES = torch.tensor([2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 0, 1])
+
+# The order TennisEnv lists cards in a hand: highest rank first, ties broken by suit
+_HAND_ORDER = torch.tensor(sorted(range(NUM_CARDS), key=lambda index: (-(index % 13), index // 13)))
+
+# The suit isomorphism assigns suits in the order S, D, H, C (as suit indices) and writes them
+#   to the state in the column order C, D, H, S
+_MAPPING_ORDER = torch.tensor([1, 3, 2, 0])
+_MAPPING_PRIORITY = torch.tensor([3, 0, 2, 1]) # position of each suit index in _MAPPING_ORDER
+_STATE_COLUMNS = torch.tensor([0, 3, 2, 1])
+
+class VecTennisEnv:
+    """
+    VecTennisEnv plays a batch of Tennis games in lockstep.
+
+    Every game has the same number of plies and the seats always alternate between leader and dealer,
+    so all games are at the same ply at the same time. The games are stored as tensors, the states are
+    encoded exactly like TennisEnv.get_current_state and actions use the same suit-mapped action space.
+
+    Attributes:
+        num_envs (int): The number of games played at once.
+        hands (torch.Tensor): [N, 4, 52] bool, the cards held in each hand.
+        bids (torch.Tensor): [N, 4] long, the card bid for each hand, or -1.
+        trick (torch.Tensor): [N, 4] long, the cards in the current trick, or -1.
+        wins (torch.Tensor): [N, 4] long, the tricks won by each hand.
+        trump (torch.Tensor): [N] bool, True if spades are trump.
+        ply (int): The number of actions taken so far in every game.
+    """
+
+    def __init__(self, leader, dealer, num_envs, rewarded_player="leader", seed=None):
+        """
+        Initialize the vectorized Tennis environment.
+
+        Args:
+            leader (DQN): The agent that picks moves for the leader when it is the opponent.
+            dealer (DQN): The agent that picks moves for the dealer when it is the opponent.
+            num_envs (int): The number of games to play in lockstep.
+            rewarded_player (str): Controls which player (leader or dealer) defines the reward for the environment.
+                                   Must be either "leader" or "dealer".
+            seed (int, optional): Seed for the generator used to deal cards and pick trump suits.
+
+        Raises:
+            AssertionError: If the rewarded_player is not "leader" or "dealer".
+        """
+        assert(rewarded_player in ["leader", "dealer"]), "rewarded_player must be either 'leader' or 'dealer'"
+        self.rewarded_player = rewarded_player
+        self.num_envs = num_envs
+
+        self.leader_q_network = leader
+        self.dealer_q_network = dealer
+
+        self.generator = torch.Generator()
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+        self.done = False
+
+    def reset(self, deals=None, trump=None):
+        """
+        Deal new games to every environment.
+
+        Args:
+            deals (torch.Tensor, optional): [N, 52] card indices, split into hands as in DEAL_SLICES.
+                                            Random deals are used if not given.
+            trump (torch.Tensor, optional): [N] bool, True if spades are trump. Chosen randomly if not given.
+
+        Returns:
+            torch.Tensor: The [N, STATE_SIZE] states after reset.
+        """
+        n = self.num_envs
+        if deals is None:
+            deals = torch.rand(n, NUM_CARDS, generator=self.generator).argsort(dim=1)
+        if trump is None:
+            trump = torch.rand(n, generator=self.generator) < 0.5
+        self.deals = deals.long()
+        self.trump = trump.bool()
+
+        self.hands = torch.zeros(n, 4, NUM_CARDS, dtype=torch.bool)
+        self.bids = torch.full((n, 4), -1, dtype=torch.long)
+        self.trick = torch.full((n, 4), -1, dtype=torch.long)
+        self.wins = torch.zeros(n, 4, dtype=torch.long)
+        self.rewards = torch.zeros(n)
+        self.ply = 0
+        self.done = False
+
+        # Only the backhands are dealt before the first bids
+        self._deal(LEADER_BACKHAND)
+        self._deal(DEALER_BACKHAND)
+
+        if self.rewarded_player == "dealer":
+            self.step_helper(self.leader_q_network.choose_actions(self.observations(), self.legal_mask()))
+
+        return self.observations()
+
+    def step(self, actions):
+        """
+        Play the trainee's actions, then the opponent's reply, in every game.
+
+        Args:
+            actions (torch.Tensor): [N] action indices, one per game.
+
+        Returns:
+            tuple: The [N, STATE_SIZE] next states, the [N] rewards, the done flag and an info dict.
+        """
+        next_states, rewards, done, exit_cond = self.step_helper(actions)
+        if done:
+            return next_states, rewards, done, exit_cond
+
+        opponent = self.dealer_q_network if self.rewarded_player == "leader" else self.leader_q_network
+        return self.step_helper(opponent.choose_actions(next_states, self.legal_mask()))
+
+    def step_helper(self, actions):
+        """
+        Play one ply in every game.
+
+        Args:
+            actions (torch.Tensor): [N] action indices in the suit-mapped action space.
+
+        Returns:
+            tuple: The [N, STATE_SIZE] next states, the [N] rewards, the done flag and an info dict.
+        """
+        assert not self.done, "All games are finished, call reset first"
+        actions = torch.as_tensor(actions).view(-1).long().cpu()
+        rows = torch.arange(self.num_envs)
+
+        # Check that the played cards are legal moves
+        assert(self.legal_mask()[rows, actions].all())
+
+        # Apply reverse mapping
+        inverse_suits = self.get_suit_mapping().argsort(dim=1)
+        cards = inverse_suits[rows, actions // 13] * 13 + actions % 13
+
+        if self.ply < 4:
+            hand = BID_HANDS[self.ply]
+            self.hands[rows, hand, cards] = False
+            self.bids[:, hand] = cards
+
+            # Deal the forehands once both backhand bids are made
+            if hand == DEALER_BACKHAND:
+                self._deal(LEADER_FOREHAND)
+                self._deal(DEALER_FOREHAND)
+        else:
+            position = (self.ply - 4) % 4
+            self.hands[rows, TRICK_HANDS[position], cards] = False
+            self.trick[:, position] = cards
+
+            # Find the trick winners and reset the trick
+            if position == 3:
+                winners = self._trick_winners()
+                hands = torch.tensor(TRICK_HANDS)[winners]
+                self.wins[rows, hands] += 1
+                self.trick.fill_(-1)
+
+        self.ply += 1
+        if self.ply == NUM_PLIES:
+            self.done = True
+            leader_error, dealer_error = self.bid_errors()
+            if self.rewarded_player == "leader":
+                self.rewards = (dealer_error - leader_error) / 24
+            else:
+                self.rewards = (leader_error - dealer_error) / 24
+
+        return self.observations(), self.rewards, self.done, {}
+
+    def current_player(self):
+        """Return "leader" or "dealer", the seat that acts next in every game."""
+        return "leader" if self.ply % 2 == 0 else "dealer"
+
+    def current_hand(self):
+        """Return the index of the hand the next card is taken from."""
+        if self.ply < 4:
+            return BID_HANDS[self.ply]
+        return TRICK_HANDS[(self.ply - 4) % 4]
+
+    def bid_errors(self):
+        """
+        Compute the total bid error of each player.
+
+        Returns:
+            tuple: The [N] leader errors and the [N] dealer errors.
+        """
+        bid_values = _BID_VALUES[self.bids.clamp(min=0) % 13]
+        errors = (bid_values - self.wins).abs().float()
+        return errors[:, LEADER_FOREHAND] + errors[:, LEADER_BACKHAND], errors[:, DEALER_FOREHAND] + errors[:, DEALER_BACKHAND]
+
+    def winners(self):
+        """Return a list with "leader", "dealer" or "draw" for every finished game."""
+        leader_error, dealer_error = self.bid_errors()
+        return ["leader" if l < d else "dealer" if l > d else "draw" for l, d in zip(leader_error.tolist(), dealer_error.tolist())]
+
+    def get_suit_mapping(self):
+        """
+        Compute the suit isomorphism of every game, as in TennisEnv.get_suit_mapping.
+
+        Suits are mapped in the order the leader's lowest cards reveal them, spades stay spades
+        when they are trump, and suits the leader does not hold are mapped last.
+
+        Returns:
+            torch.Tensor: [N, 4] long, the mapped suit index of each suit index.
+        """
+        leader_cards = (self.hands[:, LEADER_FOREHAND] | self.hands[:, LEADER_BACKHAND]).view(-1, 4, 13)
+        ranks = torch.arange(13).expand_as(leader_cards)
+        lowest_ranks = torch.where(leader_cards, ranks, torch.full_like(ranks, 13)).min(dim=2).values
+
+        priority = lowest_ranks * 4 + _MAPPING_PRIORITY
+        priority[:, _SPADES] = torch.where(self.trump, -1, priority[:, _SPADES])
+
+        mapping = torch.empty(self.num_envs, 4, dtype=torch.long)
+        mapping.scatter_(1, priority.argsort(dim=1), _MAPPING_ORDER.expand(self.num_envs, 4))
+        return mapping
+
+    def legal_mask(self):
+        """
+        Determine the legal moves of the current player in every game.
+
+        Returns:
+            torch.Tensor: [N, 52] bool, True for legal actions in the suit-mapped action space.
+        """
+        legal = self.hands[:, self.current_hand()].clone()
+
+        # After the first card of a trick, players must follow suit if they can
+        if self.ply >= 4 and (self.ply - 4) % 4 != 0:
+            follows = legal & (_SUITS == (self.trick[:, 0] // 13).unsqueeze(1))
+            can_follow = follows.any(dim=1, keepdim=True)
+            legal = torch.where(can_follow, follows, legal)
+
+        mapped = torch.zeros_like(legal)
+        mapped.scatter_(1, self._mapped_cards(), legal)
+        return mapped
+
+    def observations(self):
+        """
+        Encode the state of every game, as in TennisEnv.get_current_state.
+
+        Returns:
+            torch.Tensor: [N, STATE_SIZE] float states.
+        """
+        n = self.num_envs
+        columns = _STATE_COLUMNS[self.get_suit_mapping()] # the state column of each suit index
+        card_columns = columns[:, _SUITS] # [N, 52]
+
+        # Hands are listed in order, highest rank first
+        hand_tensor = torch.zeros(n, 4, 13, 4)
+        held = self.hands[:, :, _HAND_ORDER]
+        slots = held.cumsum(dim=2) - 1
+        game, hand, position = held.nonzero(as_tuple=True)
+        cards = _HAND_ORDER[position]
+        hand_tensor[game, hand, slots[game, hand, position], card_columns[game, cards]] = _STATE_VALUES[_RANKS[cards]]
+
+        return torch.cat([
+            hand_tensor.view(n, -1),
+            self._card_tensors(self.bids, card_columns).view(n, -1),
+            self._card_tensors(self.trick, card_columns).view(n, -1),
+            self.wins.float() / 12,
+            self.trump.float().unsqueeze(1),
+        ], dim=1)
+
+    def _deal(self, hand):
+        # Give the hand its cards from the deals
+        cards = self.deals[:, DEAL_SLICES[hand]]
+        self.hands[:, hand].scatter_(1, cards, True)
+
+    def _mapped_cards(self):
+        # The mapped action index of every card index, [N, 52]
+        return self.get_suit_mapping()[:, _SUITS] * 13 + _RANKS
+
+    def _trick_winners(self):
+        # Trumps beat the lead suit, and other suits never win
+        suits = self.trick // 13
+        ranks = self.trick % 13
+        is_trump = self.trump.unsqueeze(1) & (suits == _SPADES)
+        follows = suits == suits[:, :1]
+        scores = torch.where(is_trump, ranks + 26, torch.where(follows, ranks + 13, torch.full_like(ranks, -1)))
+        return scores.argmax(dim=1)
+
+    def _card_tensors(self, cards, card_columns):
+        # Encode a [N, K] tensor of card indices (or -1) as [N, K, 4]
+        n, k = cards.shape
+        tensor = torch.zeros(n, k, 4)
+        game, slot = (cards >= 0).nonzero(as_tuple=True)
+        played = cards[game, slot]
+        tensor[game, slot, card_columns[game, played]] = _STATE_VALUES[_RANKS[played]]
+        return tensor
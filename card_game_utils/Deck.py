@@ -2,45 +2,60 @@
 
 import random
 
+RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
+SUITS = ['C', 'S', 'H', 'D']
+
+# There is exactly one instance of each of the 52 cards, so cards can be compared by identity
+# Card(rank, suit) returns the interned card, and cards cannot be changed once created
 class Card:
-    def __init__(self, rank, suit):
-        assert rank, suit
-        self.rank = rank
-        self.suit = suit
+    __slots__ = ('rank', 'suit', 'rank_value', 'bid_value', 'suit_index', 'action_index')
+    _interned = {}
+
+    def __new__(cls, rank, suit):
+        try:
+            return cls._interned[(rank, suit)]
+        except KeyError:
+            raise ValueError(f"'{rank}{suit}' is not a card") from None
+
+    @classmethod
+    def _create(cls, rank, suit):
+        card = object.__new__(cls)
+        rank_value = RANKS.index(rank) + 2
+        object.__setattr__(card, 'rank', rank)
+        object.__setattr__(card, 'suit', suit)
+        object.__setattr__(card, 'rank_value', rank_value)
+        object.__setattr__(card, 'bid_value', {13: 0, 14: 1}.get(rank_value, rank_value))
+        object.__setattr__(card, 'suit_index', SUITS.index(suit))
+        object.__setattr__(card, 'action_index', 13 * SUITS.index(suit) + RANKS.index(rank))
+        cls._interned[(rank, suit)] = card
+        return card
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Cards are immutable")
+
+    def __reduce__(self):
+        return (Card, (self.rank, self.suit))
 
     def __str__(self):
         return f"{self.rank}{self.suit}"
-        
+
     def __eq__(self, other):
-        if other == None:
-            return False
-        same_rank = self.rank == other.rank
-        same_suit = self.suit == other.suit
-        return same_rank and same_suit
-    
+        return self is other
+
+    def __hash__(self):
+        return self.action_index
+
     def numeric_rank(self):
-        if self.rank == 'A':
-            return 14
-        elif self.rank == 'K':
-            return 13
-        elif self.rank == 'Q':
-            return 12
-        elif self.rank == 'J':
-            return 11
-        else:
-            return int(self.rank)
-            
+        return self.rank_value
+
     def get_bid_value(self):
-        rank = self.numeric_rank()
-        if rank == 13:
-            return 0
-        elif rank == 14:
-            return 1
-        else:
-            return rank
-        
+        return self.bid_value
+
     def copy(self):
-        return Card(self.rank, self.suit)
+        return self
+
+# All 52 cards, in the order of their action index
+CARDS = [Card._create(rank, suit) for suit in SUITS for rank in RANKS]
 
 class Deck:
     # creates an empty deck
@@ -65,9 +80,7 @@ class Deck:
     
     # puts 52 cards in the deck and shuffles it
     def reset(self):
-        ranks = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
-        suits = ['C', 'S', 'H', 'D']
-        self.cards = [Card(rank, suit) for suit in suits for rank in ranks]
+        self.cards = list(CARDS)
     
     # shuffle the deck
     def shuffle(self):
@@ -109,8 +122,8 @@ class Deck:
         best_dist = 100 # some high value
         best_card = None
         for card in self.cards:
-            new_dist = abs(rank - card.numeric_rank())
-            if new_dist < best_dist or (new_dist == best_dist and card.numeric_rank() < rank):
+            new_dist = abs(rank - card.rank_value)
+            if new_dist < best_dist or (new_dist == best_dist and card.rank_value < rank):
                 best_dist = new_dist
                 best_card = card
         return best_card
@@ -120,19 +133,11 @@ class Deck:
     # used for Tennis
     def closest_bid_card(self, bid):
         # the value of cards during a bid is different than during a trick
-        def get_bid_value(card: Card):
-            rank = card.numeric_rank()
-            if rank == 13:
-                return 0
-            elif rank == 14:
-                return 1
-            else:
-                return rank
         best_dist = 100 # some high value
         best_card = None
         for card in self.cards:
-            new_dist = abs(bid - get_bid_value(card))
-            if new_dist < best_dist or (new_dist == best_dist and get_bid_value(card) < bid):
+            new_dist = abs(bid - card.bid_value)
+            if new_dist < best_dist or (new_dist == best_dist and card.bid_value < bid):
                 best_dist = new_dist
                 best_card = card
         return best_card
@@ -140,7 +145,7 @@ class Deck:
     # sorts the deck so that the highest ranking cards are at the top
     # set reverse to false to put low ranking cards at the top
     def sort_by_rank(self, reverse=False):
-        self.cards.sort(key=lambda card: -card.numeric_rank(), reverse=reverse)
+        self.cards.sort(key=lambda card: -card.rank_value, reverse=reverse)
 
     # sorts the deck so that the most common suit is on the top, and
     #   within a suit the highest rank is on the top
@@ -152,14 +157,14 @@ class Deck:
             suit_count[card.suit] += 1
         
         # Sort the cards using a custom sorting key
-        self.cards.sort(key=lambda card: (suit_count[card.suit], card.numeric_rank()), reverse=True)
+        self.cards.sort(key=lambda card: (suit_count[card.suit], card.rank_value), reverse=True)
     
     
     # find the average rank of this deck
     def average_numeric_rank(self):
         total_numeric_rank = 0
         for card in self.cards:
-            total_numeric_rank += card.numeric_rank()
+            total_numeric_rank += card.rank_value
         return total_numeric_rank/len(self)
 
     # returns the count of the given suit
@@ -170,9 +175,9 @@ class Deck:
                 suit_count += 1
         return suit_count
         
+    # cards are immutable, so a copy only needs a new list
     def copy(self):
        new_deck = Deck()
-       for card in self.cards:
-           new_deck.add(Card(card.rank, card.suit))
+       new_deck.cards = list(self.cards)
        return new_deck
 
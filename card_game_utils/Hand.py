@@ -0,0 +1,123 @@
+# This script represents a hand of cards as a 52-bit integer (a bitboard)
+# Bit i is set when the card with action index i is in the hand, where the
+#   action index follows the order of Deck.reset: suit-major, then rank
+
+from .Deck import Deck, Card, CARDS, RANKS, SUITS
+
+# A mask with all 13 bits of each suit set
+SUIT_MASKS = {suit: ((1 << 13) - 1) << (13 * i) for i, suit in enumerate(SUITS)}
+FULL_MASK = (1 << 52) - 1
+
+# The order cards are iterated in: highest rank first, ties broken by suit
+_ORDER = sorted(range(52), key=lambda index: (-(index % 13), index // 13))
+_POSITION = [0] * 52
+for _position, _index in enumerate(_ORDER):
+    _POSITION[_index] = _position
+
+class Hand:
+    # creates an empty hand, or a hand holding the given bits
+    def __init__(self, bits=0):
+        self.bits = bits
+        self.reverse = False # iterate low ranking cards first when True
+        self._cards = None # the sorted cards, kept through removals and rebuilt after other changes
+
+    # returns the number of cards in the hand
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __str__(self):
+        return f"[{', '.join([str(card) for card in self])}]"
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __getitem__(self, key):
+        return self.cards[key]
+
+    def __contains__(self, card):
+        return self.has_card(card)
+
+    def __add__(self, other):
+        new_hand = Hand(self.bits)
+        new_hand.add(other)
+        return new_hand
+
+    # the cards in the hand, highest ranking first (lowest first if reversed)
+    @property
+    def cards(self):
+        if self._cards is None:
+            self._cards = self._sorted_cards()
+        return self._cards
+
+    def _sorted_cards(self):
+        indices = []
+        bits = self.bits
+        while bits:
+            low_bit = bits & -bits
+            indices.append(low_bit.bit_length() - 1)
+            bits ^= low_bit
+        indices.sort(key=_POSITION.__getitem__, reverse=self.reverse)
+        return [CARDS[index] for index in indices]
+
+    # puts all 52 cards in the hand
+    def reset(self):
+        self.bits = FULL_MASK
+        self._cards = None
+
+    # checks if the given card is in the hand
+    def has_card(self, card: Card):
+        if not isinstance(card, Card):
+            return False
+        return bool(self.bits >> card.action_index & 1)
+
+    # removes and returns the given number of cards from the top of the hand
+    def draw(self, num):
+        if num > len(self):
+            raise ValueError("Not enough cards in the hand.")
+        return_hand = Hand()
+        return_hand.add(self.cards[:num])
+        self.bits &= ~return_hand.bits
+        self._cards = self._cards[num:]
+        return return_hand
+
+    # returns the given card, if it is in the hand
+    def play(self, card: Card):
+        if not self.has_card(card):
+            raise Exception(f"Card '{card}' not found in the hand")
+        self.bits &= ~(1 << card.action_index)
+        if self._cards is not None:
+            self._cards.remove(card) # removing keeps the remaining cards sorted
+        return card
+
+    # adds the given card or cards to the hand
+    def add(self, cards):
+        self._cards = None
+        if isinstance(cards, Card):
+            self.bits |= 1 << cards.action_index
+        elif isinstance(cards, Hand):
+            self.bits |= cards.bits
+        elif isinstance(cards, (list, Deck)):
+            for card in cards:
+                self.bits |= 1 << card.action_index
+
+    # returns the count of the given suit
+    def count_suit(self, suit):
+        return (self.bits & SUIT_MASKS[suit]).bit_count()
+
+    # returns the cards of the given suit as 13 bits, one per rank from 2 to A
+    def suit_bits(self, suit):
+        return (self.bits & SUIT_MASKS[suit]) >> (13 * SUITS.index(suit))
+
+    # the order of a bitboard is fixed, so sorting only picks the direction
+    # set reverse to true to put low ranking cards at the top
+    def sort_by_rank(self, reverse=False):
+        if reverse != self.reverse:
+            self.reverse = reverse
+            self._cards = None
+
+    def copy(self):
+        new_hand = Hand(self.bits)
+        new_hand.reverse = self.reverse
+        if self._cards is not None:
+            new_hand._cards = list(self._cards)
+        return new_hand
@@ -38,7 +38,7 @@ class Trick():
         if len(self.cards) == 0:
             return True
         elif card.suit == self.winning_card.suit:
-            if card.numeric_rank() > self.winning_card.numeric_rank():
+            if card.rank_value > self.winning_card.rank_value:
                 return True
         elif card.suit == self.trump_suit:
             return True
@@ -47,9 +47,10 @@ class Trick():
     def get_legal_moves(self, deck):
         if len(self.cards) == 0:
             return deck.copy()
-        elif self.lead_suit in [card.suit for card in deck.cards]:
+        following_cards = [card for card in deck.cards if card.suit == self.lead_suit]
+        if following_cards:
             return_deck = Deck()
-            return_deck.add([card for card in deck.cards if card.suit == self.lead_suit])
+            return_deck.add(following_cards)
             return return_deck
         else:
             return deck.copy()